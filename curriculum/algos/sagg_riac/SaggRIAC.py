@@ -1,6 +1,4 @@
 import collections
-import random
-import operator
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -12,14 +10,40 @@ from curriculum.logging.visualization import save_image
 from rllab.misc import logger
 
 
+def _slice_bound(index, length):
+    # where a python slice bound (possibly negative) lands in a sequence of the given length
+    index = np.where(index < 0, index + length, index)
+    return np.minimum(np.maximum(index, 0), length)
+
+
+def _window_interests(prefix, offset, num_states, max_history):
+    """
+    Vectorized Region.compute_interest for several sequences of competences stored contiguously.
+    :param prefix: array (n_seqs, L + 1) of cumulative sums of the competences, starting with 0
+    :param offset: array (n_seqs,) with the position in prefix where each sequence starts
+    :param num_states: array (n_seqs,) with the length of each sequence
+    """
+    rows = np.arange(len(prefix))
+
+    def measure(start, end):
+        start = _slice_bound(start, num_states)
+        end = np.maximum(_slice_bound(end, num_states), start)
+        return prefix[rows, offset + end] - prefix[rows, offset + start]
+
+    old_measure = measure(num_states - max_history, num_states - int(max_history / 2))
+    new_measure = measure(num_states - int(max_history / 2), num_states)
+    return np.abs(old_measure - new_measure) / np.maximum(num_states, 1)
+
+
 class Region(object):
 
     def __init__(self, min_border, max_border, max_history=500, max_goals=500, num_random_splits=50, mode3_noise=0.1):
         # self.states = collections.deque(maxlen=max_history)
         # self.competences = collections.deque(maxlen=max_history)
 
-        self.states = []
-        self.competences = []
+        # array-backed buffers, grown by doubling: only the first num_goals rows are valid
+        self._states = np.zeros((0, len(min_border)))
+        self._competences = np.zeros(0)
 
         self.min_border = min_border
         self.max_border = max_border
@@ -29,11 +53,42 @@ class Region(object):
         self.num_random_splits = num_random_splits
         self.mode3_noise = mode3_noise
 
+        # set when the region is split: the states with state[split_dim] <= split_val belong to children[0]
+        self.split_dim = None
+        self.split_val = None
+        self.children = None
+
+    @property
+    def states(self):
+        return self._states[:self.num_goals]
+
+    @property
+    def competences(self):
+        return self._competences[:self.num_goals]
+
+    def is_leaf(self):
+        return self.children is None
+
+    def find_leaf(self, state):
+        region = self
+        while not region.is_leaf():
+            region = region.children[0] if state[region.split_dim] <= region.split_val else region.children[1]
+        return region
+
     # Add this state and competence to the region.
     def add_state(self, state, competence):
-        self.states.append(state)
-        self.competences.append(competence)
-        self.num_goals += 1
+        self.add_states(np.reshape(state, (1, -1)), [competence])
+
+    def add_states(self, states, competences):
+        states = np.asarray(states, dtype=float)
+        new_num_goals = self.num_goals + len(states)
+        if new_num_goals > len(self._states):
+            capacity = max(new_num_goals, 2 * len(self._states))
+            self._states = np.resize(self._states, (capacity, self._states.shape[1]))
+            self._competences = np.resize(self._competences, capacity)
+        self._states[self.num_goals:new_num_goals] = states
+        self._competences[self.num_goals:new_num_goals] = competences
+        self.num_goals = new_num_goals
 
     def is_too_big(self):
         # Split this region if it has too many goals, and if some of the goals have a positive competence!
@@ -51,62 +106,67 @@ class Region(object):
         #region1, region2 = self.hacky_split()
         region1, region2, success = self.optimal_split()
 
-        # if success:
-        #     self.assign_states_to_regions(region1, region2)
+        if success:
+            self.children = [region1, region2]
 
         return [region1, region2, success]
 
     def assign_states_to_regions(self, region1, region2):
         # Reassign all goals to one of these regions.
-        for state, competence in zip(self.states, self.competences):
-            if region1.contains(state):
-                region1.add_state(state, competence)
-            elif region2.contains(state):
-                region2.add_state(state, competence)
-            else:
-                logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
-                logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
-                raise Exception("Split region; now cannot find region for state: " + str(state))
+        in_region1 = np.all((region1.min_border <= self.states) & (self.states <= region1.max_border), axis=1)
+        in_region2 = ~in_region1 & np.all((region2.min_border <= self.states) & (self.states <= region2.max_border),
+                                          axis=1)
+        if not np.all(in_region1 | in_region2):
+            logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
+            logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
+            raise Exception("Split region; now cannot find region for state: " +
+                            str(self.states[~(in_region1 | in_region2)][0]))
+        region1.add_states(self.states[in_region1], self.competences[in_region1])
+        region2.add_states(self.states[in_region2], self.competences[in_region2])
 
     def optimal_split(self):
-        # All split scores must be >= 0
-        max_split_score = -1
-        max_region1 = None
-        max_region2 = None
-
         num_dim = len(self.min_border)
-        for i in range(self.num_random_splits):
-            split_dim = random.randrange(num_dim)
-            split_val = random.uniform(self.min_border[split_dim], self.max_border[split_dim])
-            region1, region2 = self.make_regions(split_dim, split_val)
-            self.assign_states_to_regions(region1, region2)
-            split_score = len(region1.states) * len(region2.states) * abs(region1.compute_interest() - region2.compute_interest())
-
-            if split_score > max_split_score:
-                max_region1 = region1
-                max_region2 = region2
-                max_split_score = split_score
-
-        if max_split_score == -1 or max_region1 is None:
+        if self.num_random_splits <= 0 or num_dim == 0:
             #TODO - what to do here?
             print("Problem - unable to find a good split!")
-            success = False
-        else:
-            success = True
-
-        return [max_region1, max_region2, success]
+            return [None, None, False]
+
+        # draw all the candidate splits, and score them in one pass over the states of the region
+        split_dims = np.random.randint(num_dim, size=self.num_random_splits)
+        split_vals = np.random.uniform(np.asarray(self.min_border)[split_dims],
+                                       np.asarray(self.max_border)[split_dims])
+        in_region1 = self.states[:, split_dims].T <= split_vals[:, None]
+        num_region1 = np.sum(in_region1, axis=1)
+        num_region2 = self.num_goals - num_region1
+
+        # competences of each candidate ordered as [region1 states, region2 states], keeping the insertion order
+        order = np.argsort(~in_region1, axis=1, kind='mergesort')
+        prefix = np.zeros((self.num_random_splits, self.num_goals + 1))
+        prefix[:, 1:] = np.cumsum(self.competences[order], axis=1)
+        interests1 = _window_interests(prefix, np.zeros_like(num_region1), num_region1, self.max_history)
+        interests2 = _window_interests(prefix, num_region1, num_region2, self.max_history)
+        split_scores = num_region1 * num_region2 * np.abs(interests1 - interests2)
+
+        best = np.argmax(split_scores)
+        self.split_dim = split_dims[best]
+        self.split_val = split_vals[best]
+        region1, region2 = self.make_regions(self.split_dim, self.split_val)
+        self.assign_states_to_regions(region1, region2)
+        return [region1, region2, True]
 
     def make_regions(self, split_dim, split_val):
         # For now, just perform a single split.
         region1_min = np.copy(self.min_border)
         region1_max = np.copy(self.max_border)
         region1_max[split_dim] = split_val
-        region1 = Region(region1_min, region1_max, max_history=self.max_history, max_goals=self.max_goals)
+        region1 = Region(region1_min, region1_max, max_history=self.max_history, max_goals=self.max_goals,
+                         num_random_splits=self.num_random_splits, mode3_noise=self.mode3_noise)
 
         region2_min = np.copy(self.min_border)
         region2_min[split_dim] = split_val
         region2_max = np.copy(self.max_border)
-        region2 = Region(region2_min, region2_max, max_history=self.max_history, max_goals=self.max_goals)
+        region2 = Region(region2_min, region2_max, max_history=self.max_history, max_goals=self.max_goals,
+                         num_random_splits=self.num_random_splits, mode3_noise=self.mode3_noise)
 
         return [region1, region2]
 
@@ -126,22 +186,17 @@ class Region(object):
 
     # Compute the sum of the competences in a given range.
     def compute_local_measure(self, start_index, end_index):
-        return np.sum(np.array(self.competences)[start_index:end_index])
+        return np.sum(self.competences[start_index:end_index])
 
     # Compute the derivative of competences.
     def compute_interest(self):
-        num_states = len(self.states)
+        num_states = self.num_goals
 
         if num_states == 0:
             return 0
 
-        old_measure = self.compute_local_measure(num_states - self.max_history, num_states - int(self.max_history/2))
-        new_measure = self.compute_local_measure(num_states - int(self.max_history/2), num_states)
-
-        # old_measure = self.compute_local_measure(0, int(num_states/2))
-        # new_measure = self.compute_local_measure(int(num_states/2), num_states)
-        interest = abs(old_measure - new_measure) / num_states
-        return interest
+        prefix = np.concatenate([[0.], np.cumsum(self.competences)]).reshape((1, -1))
+        return _window_interests(prefix, np.zeros(1, dtype=int), np.array([num_states]), self.max_history)[0]
 
     # Check whether this state is inside this region.
     def contains(self, state):
@@ -149,20 +204,18 @@ class Region(object):
         # Check whether this state is between the borders.
         return (np.less_equal(self.min_border, state).all() and np.less_equal(state, self.max_border).all())
 
-    def sample_uniform(self):
-        state = []
-        for min_val, max_val in zip(self.min_border, self.max_border):
-            state.append(random.uniform(min_val, max_val))
-        return state
+    def sample_uniform(self, num_samples=1):
+        return np.random.uniform(self.min_border, self.max_border, (num_samples, len(self.min_border)))
 
-    def sample_mode3(self):
+    def lowest_competence_state(self):
         # Find the lowest competence goal in this region.
-        min_index, min_value = min(enumerate(self.competences), key=operator.itemgetter(1))
-        bad_goal = np.copy(self.states[min_index])
+        return self.states[np.argmin(self.competences)]
+
+    def sample_mode3(self, num_samples=1):
+        bad_goal = self.lowest_competence_state()
 
         # Add noise to this goal.
-        bad_goal += np.random.normal(0, self.mode3_noise, len(bad_goal))
-        return bad_goal.tolist()
+        return bad_goal + np.random.normal(0, self.mode3_noise, (num_samples, len(bad_goal)))
 
 
 class SaggRIAC(object):
@@ -194,19 +247,15 @@ class SaggRIAC(object):
         self.whole_region = Region(self.min_border, self.max_border, max_history=max_history, max_goals=self.max_goals)
         self.regions.append(self.whole_region)
 
-    # Limit this sample to the boundaries of the region.
-    def limit_sample(self, sample):
-        sample = list(np.clip(sample, self.min_border, self.max_border))
-        #sample = min(sample, self.max_border.tolist())
-        #sample = max(sample, self.min_border.tolist())
-        return sample
+    # Limit these samples to the boundaries of the region.
+    def limit_sample(self, samples):
+        return np.clip(samples, self.min_border, self.max_border)
 
-    # Find the region that contains a given state.
+    # Find the region that contains a given state, descending the tree of splits from the whole region.
     def find_region(self, state):
-        for index, region in enumerate(self.regions):
-            if region.contains(state):
-                return [index, region]
-        raise Exception("Cannot find state: " + str(state) + " in any region!")
+        if not self.whole_region.contains(state):
+            raise Exception("Cannot find state: " + str(state) + " in any region!")
+        return self.whole_region.find_leaf(state)
 
     def add_accidental_states(self, states, extend_dist_rew):
         # Treat these accidental states as if we reached them with the highest competence.
@@ -220,7 +269,7 @@ class SaggRIAC(object):
     def add_states(self, states, competences):
         for state, competence in zip(states, competences):
             # Find the appropriate region for this state.
-            index, region = self.find_region(state)
+            region = self.find_region(state)
             # Add this state to the region.
             region.add_state(state, competence)
 
@@ -229,9 +278,9 @@ class SaggRIAC(object):
                 [region1, region2, success] = region.split()
                 if success:
                     # Add the subregions and delete the original region.
+                    self.regions.remove(region)
                     self.regions.append(region1)
                     self.regions.append(region2)
-                    del self.regions[index]
 
     # Sample states from the regions.
     def sample_states(self, num_samples):
@@ -239,38 +288,50 @@ class SaggRIAC(object):
         # Mode 1
         num_samples_mode1 = int(num_samples * self.mode1_p)
         samples_mode1 = self.sample_mode_1(num_samples_mode1)
-        all_samples = samples_mode1
 
         # Mode 2
         num_samples_mode2 = int(num_samples * self.mode2_p)
         samples_mode2 = self.sample_uniform(num_samples_mode2)
-        all_samples += samples_mode2
 
         # Mode 3
         num_samples_mode3 = int(num_samples * self.mode3_p)
         samples_mode3 = self.sample_mode_3(num_samples_mode3)
-        all_samples += samples_mode3
 
-        return all_samples
+        return np.concatenate([samples_mode1, samples_mode2, samples_mode3]).tolist()
+
+    def region_bounds(self):
+        """
+        Arrays (num_regions, state_size) with the min and max borders of all the regions
+        """
+        return np.array([region.min_border for region in self.regions]), \
+               np.array([region.max_border for region in self.regions])
+
+    # Sample num_per_regions[i] states uniformly from the i-th region, all in one go.
+    def sample_regions_uniform(self, num_per_regions):
+        region_indices = np.repeat(np.arange(len(self.regions)), num_per_regions)
+        min_borders, max_borders = self.region_bounds()
+        return np.random.uniform(min_borders[region_indices], max_borders[region_indices])
+
+    # Sample num_per_regions[i] noisy copies of the lowest competence state of the i-th region.
+    def sample_regions_mode3(self, num_per_regions):
+        bad_goals = np.zeros((len(self.regions), self.state_size))
+        noises = np.zeros(len(self.regions))
+        for region_index, region in enumerate(self.regions):
+            if num_per_regions[region_index] > 0:
+                bad_goals[region_index] = region.lowest_competence_state()
+                noises[region_index] = region.mode3_noise
+        region_indices = np.repeat(np.arange(len(self.regions)), num_per_regions)
+        samples = np.random.normal(bad_goals[region_indices], noises[region_indices, None])
+        return self.limit_sample(samples)
 
     # Sample uniformly at random from the whole space.
     def sample_uniform(self, num_samples):
-        samples = []
-
-        for i in range(num_samples):
-            state = self.whole_region.sample_uniform()
-            samples.append(state)
-        return samples
+        return self.whole_region.sample_uniform(num_samples)
 
     # Temporary hack - just randomly pick a region to sample from.
     def sample_random_region(self, num_samples):
-        samples = []
-        for i in range(num_samples):
-            region_index = random.randrange(len(self.regions))
-            region = self.regions[region_index]
-            state = region.sample_uniform()
-            samples.append(state)
-        return samples
+        region_indices = np.random.randint(len(self.regions), size=num_samples)
+        return self.sample_regions_uniform(np.bincount(region_indices, minlength=len(self.regions)))
 
     def sample_mode_3(self, num_samples):
         return self.sample_mode_1(num_samples, mode3=True)
@@ -287,24 +348,13 @@ class SaggRIAC(object):
 
         num_per_regions = np.random.multinomial(num_samples, probs)
 
-        samples = []
-        for region_index, num_per_region in enumerate(num_per_regions):
-            if num_per_region > 0:
-                region = self.regions[region_index]
-                for i in range(num_per_region):
-                    if mode3:
-                        sample = region.sample_mode3()
-                        sample = self.limit_sample(sample)
-                    else:
-                        sample = region.sample_uniform()
-                    samples.append(sample)
-
-        return samples
+        if mode3:
+            return self.sample_regions_mode3(num_per_regions)
+        else:
+            return self.sample_regions_uniform(num_per_regions)
 
     def compute_all_interests(self):
-        interests = np.array([])
-        for region in self.regions:
-            interests = np.append(interests, region.compute_interest())
+        interests = np.array([region.compute_interest() for region in self.regions], dtype=float)
 
         # Subtract the min interest
         min_interest = min(interests)
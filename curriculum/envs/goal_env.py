@@ -20,7 +20,7 @@ from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.base import Step
 from rllab.misc import autoargs
 from rllab.misc import logger
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, mark_env_updated
 from rllab.spaces.box import Box
 from rllab.misc.overrides import overrides
 
@@ -36,6 +36,7 @@ class GoalEnv(Serializable):
         self._goal_holder = StateAuxiliaryEnv(state_generator=goal_generator, *args, **kwargs)
 
     def update_goal_generator(self, *args, **kwargs):
+        mark_env_updated(self)
         return self._goal_holder.update_state_generator(*args, **kwargs)
         
     def update_goal(self, goal=None, *args, **kwargs):
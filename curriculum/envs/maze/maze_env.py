@@ -72,6 +72,7 @@ class MazeEnv(ProxyEnv, Serializable):
         torso_x, torso_y = self._find_robot()
         self._init_torso_x = torso_x
         self._init_torso_y = torso_y
+        self._build_occupancy_grid()
 
         for i in range(len(structure)):
             for j in range(len(structure[0])):
@@ -197,39 +198,67 @@ class MazeEnv(ProxyEnv, Serializable):
                     maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
                     return minx, maxx, miny, maxy
 
-    def _is_in_collision(self, pos):
-        x, y = pos
+    def _build_occupancy_grid(self):
+        """
+        Precompute the wall and empty-cell masks of the maze, so that collision and feasibility queries are O(1) grid
+        lookups instead of a scan over the whole MAZE_STRUCTURE.
+        """
         structure = self.MAZE_STRUCTURE
-        size_scaling = self.MAZE_SIZE_SCALING
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 1:
-                    minx = j * size_scaling - size_scaling * 0.5 - self._init_torso_x
-                    maxx = j * size_scaling + size_scaling * 0.5 - self._init_torso_x
-                    miny = i * size_scaling - size_scaling * 0.5 - self._init_torso_y
-                    maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
-                    if minx <= x <= maxx and miny <= y <= maxy:
-                        return True
-        return False
+        self._wall_grid = np.array([[cell == 1 for cell in row] for row in structure], dtype=bool)
+        self._empty_grid = np.array([[cell == 'r' or cell == 'g' or cell == 0 for cell in row] for row in structure],
+                                    dtype=bool)
+        # position of the corner of cell (0, 0), cells are MAZE_SIZE_SCALING wide and centered on their grid position
+        self._grid_origin = np.array([-self._init_torso_x, -self._init_torso_y]) - 0.5 * self.MAZE_SIZE_SCALING
+        empty_i, empty_j = np.nonzero(self._empty_grid)
+        self._empty_space = [(j * self.MAZE_SIZE_SCALING - self._init_torso_x,
+                              i * self.MAZE_SIZE_SCALING - self._init_torso_y) for i, j in zip(empty_i, empty_j)]
+
+    def _grid_coords(self, points):
+        """
+        Continuous grid coordinates (column, row) of the xy of each point: cell (i, j) spans [j, j + 1] x [i, i + 1]
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        return (points[:, :2] - self._grid_origin) / self.MAZE_SIZE_SCALING
+
+    def _lookup(self, grid, rows, cols):
+        inside = (rows >= 0) & (rows < grid.shape[0]) & (cols >= 0) & (cols < grid.shape[1])
+        result = np.zeros(rows.shape, dtype=bool)
+        result[inside] = grid[rows[inside], cols[inside]]
+        return result
+
+    def in_collision_batch(self, points):
+        """
+        :param points: array of shape (n, d>=2), only the first two coordinates (xy) are used
+        :return: boolean array telling which points lie in a wall block (boundaries included)
+        """
+        coords = self._grid_coords(points)
+        # a point on the boundary between two cells belongs to both of them
+        low = (np.ceil(coords) - 1).astype(int)
+        high = np.floor(coords).astype(int)
+        collision = np.zeros(len(coords), dtype=bool)
+        for cols in (low[:, 0], high[:, 0]):
+            for rows in (low[:, 1], high[:, 1]):
+                collision |= self._lookup(self._wall_grid, rows, cols)
+        return collision
+
+    def is_feasible_batch(self, points):
+        """
+        :param points: array of shape (n, d>=2), only the first two coordinates (xy) are used
+        :return: boolean array telling which points lie strictly inside an empty cell of the maze
+        """
+        coords = self._grid_coords(points)
+        cells = np.floor(coords).astype(int)
+        on_boundary = np.any(cells == coords, axis=1)
+        return ~on_boundary & self._lookup(self._empty_grid, cells[:, 1], cells[:, 0])
+
+    def _is_in_collision(self, pos):
+        return bool(self.in_collision_batch(pos)[0])
 
     def find_empty_space(self):
-        structure = self.MAZE_STRUCTURE
-        size_scaling = self.MAZE_SIZE_SCALING
-        empty_space = []
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 'r' or structure[i][j] == 'g' or structure[i][j] == 0:
-                    empty_space.append((j * size_scaling - self._init_torso_x, i * size_scaling - self._init_torso_y))
-                    #return j * size_scaling, i * size_scaling
-        return empty_space
+        return list(self._empty_space)
 
     def is_feasible(self, pos):  # the arg is the goal, not the full space!!!
-        empty_space = self.find_empty_space()
-        for space in empty_space:
-            if np.size(np.where(np.abs(np.array(np.array(pos).reshape(-1)[:2])-np.array(space)) < self.MAZE_SIZE_SCALING/2)[0]) == 2:
-                # print("Pos {} is in empty space: {}".format(pos, space))
-                return True
-        return False
+        return bool(self.is_feasible_batch(np.array(pos).reshape(-1))[0])
 
     @overrides
     def reset(self, *args, **kwargs):
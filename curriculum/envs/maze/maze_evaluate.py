@@ -17,6 +17,7 @@ from curriculum.envs.base import FixedStateGenerator
 # from sandbox.young_clgan.state.selectors import FixedStateSelector
 from curriculum.state.evaluator import evaluate_states
 from curriculum.logging.visualization import save_image
+from curriculum.logging.render_worker import render_image
 
 quick_test = False
 
@@ -62,13 +63,16 @@ def sample_unif_feas(train_env, samples_per_cell):
 
     size_scaling = maze_env.MAZE_SIZE_SCALING
 
-    states = []
-    for empty_space in empty_spaces:
-        for i in range(samples_per_cell):
-            state = np.array(empty_space) + np.random.uniform(-size_scaling/2, size_scaling/2, 2)
-            states.append(state)
+    centers = np.repeat(np.array(empty_spaces), samples_per_cell, axis=0)
+    states = centers + np.random.uniform(-size_scaling / 2, size_scaling / 2, centers.shape)
+    # the cell boundaries are not feasible: resample the (measure zero) points that landed on them
+    on_boundary = ~maze_env.is_feasible_batch(states)
+    while np.any(on_boundary):
+        states[on_boundary] = centers[on_boundary] + \
+                              np.random.uniform(-size_scaling / 2, size_scaling / 2, (np.sum(on_boundary), 2))
+        on_boundary = ~maze_env.is_feasible_batch(states)
 
-    return np.array(states)
+    return states
 
 
 def my_square_scatter(axes, x_array, y_array, z_array, min_z=None, max_z=None, size=0.5, **kwargs):
@@ -154,6 +158,11 @@ def plot_heatmap(rewards, goals, prefix='', spacing=1, show_heatmap=True, maze_i
     return fig
 
 
+def _heatmap_image(rewards, goals, **kwargs):
+    plot_heatmap(rewards, goals, show_heatmap=False, **kwargs)
+    return save_image()
+
+
 def test_policy(policy, train_env, as_goals=True, visualize=True, sampling_res=1, n_traj=1, parallel=True,
                 bounds = None, center = None):
 
@@ -227,41 +236,26 @@ def test_policy(policy, train_env, as_goals=True, visualize=True, sampling_res=1
 
 
 def find_empty_spaces(train_env, sampling_res=1):
-    if hasattr(train_env.wrapped_env, 'find_empty_space'):
-        maze_env = train_env.wrapped_env
-    else:
-        maze_env = train_env.wrapped_env.wrapped_env
-    empty_spaces = maze_env.find_empty_space()
+    maze_env = unwrap_maze(train_env)
+    empty_spaces = np.array(maze_env.find_empty_space())
 
     size_scaling = maze_env.MAZE_SIZE_SCALING
     num_samples = 2 ** sampling_res
     spacing = size_scaling / num_samples
     starting_offset = spacing / 2
 
-    states = []
-    distances = []
-    for empty_space in empty_spaces:
-        delta_x = empty_space[0]  # - train_env.wrapped_env._init_torso_x
-        delta_y = empty_space[1]  # - train_env.wrapped_env._init_torso_y
-        distance = (delta_x ** 2 + delta_y ** 2) ** 0.5
-        distances.append(distance)
-
+    distances = np.linalg.norm(empty_spaces, axis=1)
     sort_indices = np.argsort(distances)[::-1]
 
-    empty_spaces = np.array(empty_spaces)
     empty_spaces = empty_spaces[sort_indices]
     if quick_test:
         empty_spaces = empty_spaces[:3]
 
-    for empty_space in empty_spaces:
-        starting_x = empty_space[0] - size_scaling / 2 + starting_offset
-        starting_y = empty_space[1] - size_scaling / 2 + starting_offset
-        for i in range(num_samples):
-            for j in range(num_samples):
-                x = starting_x + i * spacing
-                y = starting_y + j * spacing
-                states.append((x, y))
-    return np.array(states), empty_spaces, spacing
+    # regular grid of num_samples x num_samples points inside every empty cell, x major
+    offsets = starting_offset - size_scaling / 2 + spacing * np.arange(num_samples)
+    cell_grid = np.stack(np.meshgrid(offsets, offsets, indexing='ij'), axis=-1).reshape((-1, 2))
+    states = (empty_spaces[:, None, :] + cell_grid[None, :, :]).reshape((-1, 2))
+    return states, empty_spaces, spacing
 
 
 def test_policy_parallel(policy, train_env, as_goals=True, visualize=True, sampling_res=1, n_traj=1, bounds = None):
@@ -312,13 +306,6 @@ def test_and_plot_policy(policy, env, as_goals=True, visualize=True, sampling_re
     while not hasattr(obj, '_maze_id') and hasattr(obj, 'wrapped_env'):
         obj = env.wrapped_env
     maze_id = obj._maze_id
-    plot_heatmap(avg_success, states, spacing=spacing, show_heatmap=False, maze_id=maze_id,
-                 center=center, limit=limit)
-    reward_img = save_image()
-
-    plot_heatmap(avg_time, states, spacing=spacing, show_heatmap=False, maze_id=maze_id,
-                 center=center, limit=limit, adaptive_range=True)
-    time_img = save_image()
 
     mean_rewards = np.mean(avg_totRewards)
     success = np.mean(avg_success)
@@ -330,6 +317,10 @@ def test_and_plot_policy(policy, env, as_goals=True, visualize=True, sampling_re
     # logger.dump_tabular(with_prefix=False)
 
     if report is not None:
+        reward_img = render_image(_heatmap_image, avg_success, states, spacing=spacing, maze_id=maze_id,
+                                  center=center, limit=limit)
+        time_img = render_image(_heatmap_image, avg_time, states, spacing=spacing, maze_id=maze_id,
+                                center=center, limit=limit, adaptive_range=True)
         report.add_image(
             reward_img,
             'policy performance\n itr: {} \nmean_rewards: {} \nsuccess: {}'.format(
@@ -351,7 +342,13 @@ def plot_policy_means(policy, env, sampling_res=2, report=None, center=None, lim
     observations = [np.concatenate([state, [0, ] * (env.observation_space.flat_dim - len(state) - len(goal)), goal]) for state in states]
     actions, agent_infos = policy.get_actions(observations)
     vecs = agent_infos['mean']
-    vars = [np.exp(log_std) * 0.25 for log_std in agent_infos['log_std']]
+    if report is not None:
+        vec_img = render_image(_draw_policy_means, states, goal, vecs, agent_infos['log_std'])
+        report.add_image(vec_img, 'policy mean')
+
+
+def _draw_policy_means(states, goal, vecs, log_stds):
+    vars = [np.exp(log_std) * 0.25 for log_std in log_stds]
     ells = [patches.Ellipse(state, width=vars[i][0], height=vars[i][1], angle=0) for i, state in enumerate(states)]
 
     fig = plt.figure()
@@ -363,9 +360,7 @@ def plot_policy_means(policy, env, sampling_res=2, report=None, center=None, lim
     Q = plt.quiver(states[:,0], states[:,1], vecs[:, 0], vecs[:, 1], units='xy', angles='xy', scale_units='xy', scale=1)  # , np.linalg.norm(vars * 4)
     qk = plt.quiverkey(Q, 0.8, 0.85, 1, r'1 Nkg', labelpos='E', coordinates='figure')
     # cb = plt.colorbar(Q)
-    vec_img = save_image()
-    if report is not None:
-        report.add_image(vec_img, 'policy mean')
+    return save_image()
 
 
 def plot_policy_values(env, baseline, sampling_res=2, report=None, center=None, limit=None):  # TODO: try other baseline
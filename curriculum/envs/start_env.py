@@ -10,7 +10,6 @@ from collections import OrderedDict
 from rllab import spaces
 import sys
 import os.path as osp
-import cloudpickle
 import pickle
 
 import numpy as np
@@ -26,7 +25,7 @@ from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.base import Step
 from rllab.misc import autoargs
 from rllab.misc import logger
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, mark_env_updated
 from rllab.spaces.box import Box
 from rllab.misc.overrides import overrides
 
@@ -61,6 +60,7 @@ class StartEnv(Serializable):
 
     def update_start_generator(self, *args, **kwargs):
         # print("updating start generator with ", *args, **kwargs)
+        mark_env_updated(self)
         return self._start_holder.update_state_generator(*args, **kwargs)
         
     def update_start(self, start=None, *args, **kwargs):
@@ -249,17 +249,15 @@ def generate_starts(env, policy=None, starts=None, horizon=50, size=10000, subsa
                 # import pdb; pdb.set_trace()
                 brownian_state_wrapper = FunctionWrapper(
                     brownian,
-                    env=env,
                     kill_outside=env.kill_outside,
                     kill_radius=env.kill_radius,  # this should be set before passing the env to generate_starts
                     horizon=horizon,
                     variance=variance,
-                    policy=policy,
                 )
                 parallel_starts = [starts[j % n_starts] for j in range(i,i+singleton_pool.n_parallel)]
                 # print("parallel sampling from :", parallel_starts)
                 i += singleton_pool.n_parallel
-                results = parallel_map(brownian_state_wrapper, parallel_starts)
+                results = parallel_map(brownian_state_wrapper, parallel_starts, env=env, policy=policy)
                 new_states = np.concatenate([result[0] for result in results])
 
                 # show where these states are:
@@ -286,13 +284,13 @@ def generate_starts(env, policy=None, starts=None, horizon=50, size=10000, subsa
 def parallel_check_feasibility(starts, env, max_path_length=50, n_processes=-1):
     feasibility_wrapper = FunctionWrapper(
         check_feasibility,
-        env =env,
         max_path_length=max_path_length,
     )
     is_feasible = parallel_map(
         feasibility_wrapper,
         starts,
         n_processes,
+        env=env,
     )
     #TODO: is there better way to do this?
     result = [starts[i] for i in range(len(starts)) if is_feasible[i]] # keep starts that are feasible only
@@ -392,8 +390,7 @@ def find_all_feasible_states_plotting(env, seed_starts, report, distance_thresho
         logger.log("number of new states: " + str(num_new_starts))
         if num_new_starts < 3:
             no_new_states += 1
-        with open(osp.join(log_dir, 'all_feasible_states.pkl'), 'wb') as f:
-            cloudpickle.dump(all_feasible_starts, f, protocol=3)
+        logger.dump_pickle(osp.join(log_dir, 'all_feasible_states.pkl'), all_feasible_starts)
 
 
         # want to plot added_states and old sampled starts
@@ -475,8 +472,7 @@ def find_all_feasible_states(env, seed_starts, distance_threshold=0.1, brownian_
         logger.log("number of new states: {}, total_states: {}".format(num_new_starts, all_feasible_starts.size))
         if num_new_starts < 10:
             no_new_states += 1
-        with open(osp.join(log_dir, 'all_feasible_states.pkl'), 'wb') as f:
-            cloudpickle.dump(all_feasible_starts, f, protocol=3)
+        logger.dump_pickle(osp.join(log_dir, 'all_feasible_states.pkl'), all_feasible_starts)
 
 
 def find_all_feasible_reject_states(env, distance_threshold=0.1,):
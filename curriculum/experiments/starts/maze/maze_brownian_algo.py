@@ -136,6 +136,8 @@ def run_task(v):
                 step_size=0.01,
                 discount=v['discount'],
                 plot=False,
+                persistent_opt=True,
+                sampler_args=dict(persistent_workers=True),
             )
 
             trpo_paths = algo.train()
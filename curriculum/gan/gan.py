@@ -72,11 +72,50 @@ class FCGAN(object):
                 self.generator_is_training, self.configs,
             )
 
+        # the training data is staged once per train call in (unshaped) variables, preshuffled, and cycled through
+        # on-graph by a cursor, so that the training steps need no host-side batching
+        with tf.variable_scope('fcgan_data'):
+            self.data_X_input = tf.placeholder(tf.float32, shape=[None, generator_output_size])
+            self.data_Y_input = tf.placeholder(tf.float32, shape=[None, discriminator_output_size])
+            self._data_X = tf.Variable(tf.zeros([0, generator_output_size]), trainable=False, validate_shape=False)
+            self._data_Y = tf.Variable(tf.zeros([0, discriminator_output_size]), trainable=False,
+                                       validate_shape=False)
+            self._data_cursor = tf.Variable(0, trainable=False)
+
+            # seeded from np.random as the generator noise, so that the minibatch order is reproducible
+            shuffle = tf.random_shuffle(tf.range(tf.shape(self.data_X_input)[0]), seed=np.random.randint(2 ** 31))
+            self.stage_data_op = tf.group(
+                tf.assign(self._data_X, tf.gather(self.data_X_input, shuffle), validate_shape=False),
+                tf.assign(self._data_Y, tf.gather(self.data_Y_input, shuffle), validate_shape=False),
+                tf.assign(self._data_cursor, 0),
+            )
+
+            # same batches as batch_feed_array: wrap around the end of the data, the whole data if it is smaller
+            data_size = tf.shape(self._data_X)[0]
+            batch_indices = tf.mod(
+                self._data_cursor + tf.range(tf.minimum(self.configs['batch_size'], data_size)), data_size
+            )
+            with tf.control_dependencies([batch_indices]):
+                advance_cursor_op = tf.assign(
+                    self._data_cursor, tf.mod(self._data_cursor + tf.size(batch_indices), data_size)
+                )
+            data_batch_X = tf.reshape(tf.gather(self._data_X, batch_indices), [-1, generator_output_size])
+            data_batch_Y = tf.reshape(tf.gather(self._data_Y, batch_indices), [-1, discriminator_output_size])
+
+        # real samples of a discriminator training step, the staged data unless fed. The generated half of the step
+        # is drawn on-graph, so that sampling and update run in a single session call
+        self.real_input = tf.placeholder_with_default(data_batch_X, shape=[None, generator_output_size])
+        self.real_label = tf.placeholder_with_default(data_batch_Y, shape=[None, discriminator_output_size])
+        generated_input = tf.stop_gradient(self.generator.output)
+        generated_label = tf.zeros(tf.stack([tf.shape(generated_input)[0], discriminator_output_size]))
+
         with tf.variable_scope("discriminator"):
             self.discriminator = Discriminator(
                 self.generator.output, generator_output_size,
                 discriminator_layers, discriminator_output_size,
                 self.discriminator_is_training, self.configs,
+                default_sample_input=tf.concat([self.real_input, generated_input], 0),
+                default_label=tf.concat([self.real_label, generated_label], 0),
             )
 
         self.generator_variables = tf.get_collection(
@@ -100,6 +139,9 @@ class FCGAN(object):
                 var_list=self.discriminator_variables
             )
 
+        # one discriminator step on the next staged minibatch
+        self.discriminator_data_train_op = tf.group(self.discriminator_train_op, advance_cursor_op)
+
         self.generator_optimizer_variables = tf.get_collection(
             tf.GraphKeys.GLOBAL_VARIABLES,
             'fcgan_generator_optimizer'
@@ -119,6 +161,9 @@ class FCGAN(object):
         self.tf_session.run(
             self.initialize_trainable_variable_op
         )
+        self.tf_session.run(
+            tf.variables_initializer([self._data_X, self._data_Y, self._data_cursor])
+        )
 
         self.initialize_generator_optimizer_op = tf.variables_initializer(
             self.generator_optimizer_variables
@@ -150,38 +195,24 @@ class FCGAN(object):
         return np.random.randn(size, self.noise_size)
 
     def sample_generator(self, size):
-        generator_samples = []
-        generator_noise = []
-        batch_size = self.configs['batch_size']
-        for i in range(0, size, batch_size):
-            sample_size = min(batch_size, size - i)
-            noise = self.sample_random_noise(sample_size)
-            generator_noise.append(noise)
-            generator_samples.append(
-                self.tf_session.run(
-                    self.generator.output,
-                    {self.generator.input: noise}
-                )
-            )
-        return np.vstack(generator_samples), np.vstack(generator_noise)
+        # the noise is drawn by the graph, so this is a single call whatever the size
+        return self.tf_session.run(
+            [self.generator.output, self.generator.input],
+            {self.generator.noise_batch_size: size}
+        )
 
     def train(self, X, Y, outer_iters, generator_iters=None, discriminator_iters=None):
         if generator_iters is None:
             generator_iters = self.configs['default_generator_iters']
         if discriminator_iters is None:
             discriminator_iters = self.configs['default_discriminator_iters']
-        
-        sample_size = X.shape[0]
-        train_size = sample_size
-        
-        batch_size = self.configs['batch_size']
-        
-        generated_Y = np.zeros((batch_size, self.discriminator_output_size))
-        
-        batch_feed_X = batch_feed_array(X, batch_size)
-        batch_feed_Y = batch_feed_array(Y, batch_size)
-        
-        
+
+        self.tf_session.run(
+            self.stage_data_op,
+            {self.data_X_input: X, self.data_Y_input: Y}
+        )
+
+        dis_log_loss = gen_log_loss = None
         for i in range(outer_iters):
             if self.configs['reset_generator_optimizer']:
                 self.tf_session.run(
@@ -191,26 +222,37 @@ class FCGAN(object):
                 self.tf_session.run(
                     self.initialize_discriminator_optimizer_op
                 )
-            
+
+            # the losses are only fetched when they are printed, and at the last iteration to be returned
+            print_losses = i % self.configs['print_iteration'] == 0 and not self.configs['supress_all_logging']
+            fetch_losses = print_losses or i == outer_iters - 1
+
             for j in range(discriminator_iters):
-                sample_X = next(batch_feed_X)
-                sample_Y = next(batch_feed_Y)
-                generated_X, random_noise = self.sample_generator(batch_size)
-                
-                train_X = np.vstack([sample_X, generated_X])
-                train_Y = np.vstack([sample_Y, generated_Y])
-                
-                dis_log_loss = self.train_discriminator(
-                    train_X, train_Y, 1, no_batch=True
-                )
-            
-            for i in range(generator_iters):
-                gen_log_loss = self.train_generator(random_noise, 1)
-                if i > 5:
-                    random_noise = self.sample_random_noise(batch_size)
-                
-            
-            if i % self.configs['print_iteration'] == 0 and not self.configs['supress_all_logging']:
+                # batch_size generated samples, labeled 0, are appended to the real ones by the graph
+                if fetch_losses and j == discriminator_iters - 1:
+                    dis_log_loss, _ = self.tf_session.run(
+                        [self.discriminator.discriminator_loss, self.discriminator_data_train_op],
+                        {self.discriminator_is_training: True}
+                    )
+                else:
+                    self.tf_session.run(
+                        self.discriminator_data_train_op,
+                        {self.discriminator_is_training: True}
+                    )
+
+            for j in range(generator_iters):
+                if fetch_losses and j == generator_iters - 1:
+                    gen_log_loss, _ = self.tf_session.run(
+                        [self.discriminator.generator_loss, self.generator_train_op],
+                        {self.generator_is_training: True}
+                    )
+                else:
+                    self.tf_session.run(
+                        self.generator_train_op,
+                        {self.generator_is_training: True}
+                    )
+
+            if print_losses:
                 print('Iter: {}, generator loss: {}, discriminator loss: {}'.format(i, gen_log_loss, dis_log_loss))
 
         return dis_log_loss, gen_log_loss
@@ -283,7 +325,13 @@ class FCGAN(object):
 class Generator(object):
     def __init__(self, output_size, hidden_layers, noise_size, is_training, configs):
         self.configs = configs
-        self._input = tf.placeholder(tf.float32, shape=[None, noise_size])
+        # the input noise is drawn on-graph unless it is fed, noise_batch_size sets how many rows are drawn. The op
+        # seed comes from np.random, so that the noise is reproducible for the seed of the experiment
+        self._noise_batch_size = tf.placeholder_with_default(configs['batch_size'], [])
+        self._input = tf.placeholder_with_default(
+            tf.random_normal(tf.stack([self._noise_batch_size, noise_size]), seed=np.random.randint(2 ** 31)),
+            shape=[None, noise_size]
+        )
         out = self._input
 
         for size in hidden_layers:
@@ -323,6 +371,10 @@ class Generator(object):
     def input(self):
         return self._input
 
+    @property
+    def noise_batch_size(self):
+        return self._noise_batch_size
+
     @property
     def output(self):
         return self._output
@@ -330,10 +382,16 @@ class Generator(object):
 
 class Discriminator(object):
     def __init__(self, generator_output, input_size, hidden_layers, output_size,
-                 is_training, configs):
+                 is_training, configs, default_sample_input=None, default_label=None):
         self._generator_input = generator_output
-        self._sample_input = tf.placeholder(tf.float32, shape=[None, input_size])
-        self._label = tf.placeholder(tf.float32, shape=[None, output_size])
+        if default_sample_input is None:
+            self._sample_input = tf.placeholder(tf.float32, shape=[None, input_size])
+        else:
+            self._sample_input = tf.placeholder_with_default(default_sample_input, shape=[None, input_size])
+        if default_label is None:
+            self._label = tf.placeholder(tf.float32, shape=[None, output_size])
+        else:
+            self._label = tf.placeholder_with_default(default_label, shape=[None, output_size])
         self.configs = configs
         
         self.sample_discriminator = DiscriminatorNet(
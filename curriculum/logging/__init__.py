@@ -2,12 +2,14 @@ from curriculum.logging.logger import AttrDict, ExperimentLogger, format_experim
 from curriculum.logging.visualization import plot_policy_reward, plot_labeled_samples, plot_gan_samples, \
     plot_line_graph
 from curriculum.logging.html_report import format_dict, HTMLReport
+from curriculum.logging.render_worker import start_render_worker, flush_render_worker, stop_render_worker
 
 export = [
     format_dict, HTMLReport,
     AttrDict, ExperimentLogger, format_experiment_log_path, make_log_dirs,
     plot_policy_reward, plot_labeled_samples, plot_gan_samples,
     plot_line_graph,
+    start_render_worker, flush_render_worker, stop_render_worker,
 ]
 
 __all__ = [obj.__name__ for obj in export]
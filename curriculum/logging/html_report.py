@@ -9,10 +9,17 @@ from skimage.io import imread, imsave
 from skimage import img_as_int
 
 import os
+import os.path as osp
 from io import BytesIO
 from base64 import b64encode
 import datetime
 
+from curriculum.logging.render_worker import is_pending_image
+
+
+def _save_png(img_arr, path):
+    sp_imsave(path, img_as_int(img_arr), 'png')
+
 
 def format_dict(d):
     s = ['']
@@ -29,7 +36,11 @@ def format_dict(d):
 
 
 class HTMLReport:
-    def __init__(self, path, images_per_row=2, default_image_width=400):
+    def __init__(self, path, images_per_row=2, default_image_width=400, incremental=False):
+        """
+        :param incremental: write every image once as a PNG file next to the report and only append the new content
+        to the html file on save, instead of re-rendering the whole document with the images embedded in base64
+        """
         self.path = path
         title = datetime.datetime.today().strftime(
             "Report %Y-%m-%d_%H-%M-%S_{}".format(os.uname()[1])
@@ -39,23 +50,39 @@ class HTMLReport:
         self.default_image_width = default_image_width
         self.t = None
         self.row_image_count = 0
+        self.incremental = incremental
+        # images of the render worker (see render_worker.start_render_worker), embedded by the first save after they
+        # are rendered, or by flush
+        self._pending_images = []
+        if incremental:
+            self.image_dir = osp.splitext(path)[0] + '_images'
+            if not osp.isdir(self.image_dir):
+                os.makedirs(self.image_dir)
+            self.image_count = 0
+            # elements not written yet, the open table (if any) is the last one and is rewritten on every save
+            self._fragments = ['<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n</head>\n<body>\n' % title]
+            self._committed_offset = 0
+
+    def _add(self, element):
+        if self.incremental:
+            self._fragments.append(element)
+        else:
+            self.doc.add(element)
 
     def add_header(self, str):
-        with self.doc:
-            h3(str, style='word-wrap: break-word; white-space: pre-wrap;')
+        self._add(h3(str, style='word-wrap: break-word; white-space: pre-wrap;'))
         self.t = None
         self.row_image_count = 0
         
     def add_text(self, str):
-        with self.doc:
-            p(str, style='word-wrap: break-word; white-space: pre-wrap;')
+        self._add(p(str, style='word-wrap: break-word; white-space: pre-wrap;'))
         self.t = None
         self.row_image_count = 0
 
     def _add_table(self, border=1):
         self.row_image_count = 0
         self.t = table(border=border, style="table-layout: fixed;")
-        self.doc.add(self.t)
+        self._add(self.t)
 
     def _encode_image(self, img_arr):
         """Save the image array as PNG and then encode with base64 for embedding"""
@@ -66,6 +93,21 @@ class HTMLReport:
         sio.close()
         return encoded
 
+    def _set_image_src(self, image, img_arr):
+        if self.incremental:
+            file_name = 'img_%05d.png' % self.image_count
+            self.image_count += 1
+            if is_pending_image(img_arr):
+                img_arr.apply(_save_png, osp.join(self.image_dir, file_name))
+            else:
+                _save_png(img_arr, osp.join(self.image_dir, file_name))
+            image['src'] = osp.join(osp.basename(self.image_dir), file_name)
+        elif is_pending_image(img_arr):
+            img_arr.fetch()
+            self._pending_images.append((image, img_arr))
+        else:
+            image['src'] = r'data:image/png;base64,' + self._encode_image(img_arr)
+
     def add_image(self, im, txt='', width=None, font_pct=100):
         if width is None:
             width = self.default_image_width
@@ -76,10 +118,7 @@ class HTMLReport:
             #with td(style="word-wrap: break-word;", halign="center", valign="top"):
             with td(halign="center", valign="top"):
                 with p():
-                    img(
-                        style="width:%dpx" % width,
-                        src=r'data:image/png;base64,' + self._encode_image(im)
-                    )
+                    self._set_image_src(img(style="width:%dpx" % width), im)
                     br()
                     p(
                         txt,
@@ -99,11 +138,52 @@ class HTMLReport:
         for im, txt in zip(ims, txts):
             self.add_image(im, txt, width)
 
+    def _render(self, element):
+        return (element if isinstance(element, str) else element.render() + '\n').encode('utf-8')
+
+    def _save_incremental(self):
+        # the finished elements are appended after what is already committed, the open table and the closing tags
+        # are written after them and overwritten by the next save
+        finished = self._fragments[:-1] if self.t is not None else self._fragments
+        with open(self.path, 'r+b' if self._committed_offset > 0 else 'wb') as f:
+            f.seek(self._committed_offset)
+            for element in finished:
+                f.write(self._render(element))
+            self._committed_offset = f.tell()
+            self._fragments = [self.t] if self.t is not None else []
+            for element in self._fragments:
+                f.write(self._render(element))
+            f.write(b'</body>\n</html>\n')
+            f.truncate()
+
+    def _embed_pending_images(self, wait=False):
+        still_pending = []
+        for image, pending_image in self._pending_images:
+            if wait or pending_image.ready():
+                image['src'] = r'data:image/png;base64,' + self._encode_image(pending_image.get())
+            else:
+                still_pending.append((image, pending_image))
+        self._pending_images = still_pending
+
     def save(self):
+        """
+        Write the report, without waiting for the images still being rendered: they are embedded by a later save, or
+        by flush.
+        """
+        if self.incremental:
+            self._save_incremental()
+            return
+        self._embed_pending_images()
         f = open(self.path, 'w')
         f.write(self.doc.render())
         f.close()
+
+    def flush(self):
+        """
+        Wait for all the images of the render worker and write the report.
+        """
+        self._embed_pending_images(wait=True)
+        self.save()
         
     def __del__(self):
-        self.save()
-
+        self.flush()
@@ -0,0 +1,198 @@
+import multiprocessing
+import queue
+import traceback
+import itertools
+
+_worker = None
+
+
+def _worker_loop(tasks, results):
+    images = dict()
+    errors = []
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+        command, task_id, payload = message
+        try:
+            if command == 'render':
+                fn, args, kwargs = payload
+                images[task_id] = fn(*args, **kwargs)
+            elif command == 'apply':
+                fn, args = payload
+                image = images.pop(task_id)
+                if isinstance(image, Exception):
+                    raise image
+                fn(image, *args)
+            elif command == 'get':
+                results.put((task_id, images.pop(task_id)))
+            elif command == 'discard':
+                for discarded_id in payload:
+                    images.pop(discarded_id, None)
+            elif command == 'flush':
+                results.put((task_id, errors))
+                errors = []
+        except Exception:
+            error = RuntimeError('render worker failed:\n' + traceback.format_exc())
+            if command == 'render':
+                images[task_id] = error
+            else:
+                errors.append(error)
+
+
+class PendingImage(object):
+    """
+    Image rendered by the render worker. HTMLReport.add_image accepts it directly, anywhere else it behaves as the
+    image array, blocking the first time it is accessed until the worker has rendered it.
+    """
+
+    def __init__(self, worker, task_id):
+        self._worker = worker
+        self._task_id = task_id
+        self._image = None
+        self._claimed = False
+
+    def fetch(self):
+        """
+        Ask the worker to send the image back once it is rendered, without waiting for it (see ready and get).
+        """
+        if self._image is None and not self._claimed:
+            self._claimed = True
+            self._worker._send('get', self._task_id)
+
+    def ready(self):
+        """
+        Whether get would return without blocking. Only becomes true after fetch.
+        """
+        return self._image is not None or (self._claimed and self._worker._poll(self._task_id))
+
+    def get(self):
+        if self._image is None:
+            self.fetch()
+            image = self._worker._wait(self._task_id)
+            if isinstance(image, Exception):
+                raise image
+            self._image = image
+        return self._image
+
+    def __array__(self, dtype=None):
+        image = self.get()
+        return image if dtype is None else image.astype(dtype)
+
+    def apply(self, fn, *args):
+        """
+        Have the worker call fn(image, *args) once the image is rendered, without waiting for it. The image is released
+        by the worker afterwards, so it can not be accessed anymore from here.
+        """
+        if self._image is not None:
+            fn(self._image, *args)
+        else:
+            assert not self._claimed, "the image has already been handed to the worker"
+            self._claimed = True
+            self._worker._send('apply', self._task_id, (fn, args))
+
+    def __del__(self):
+        # the worker keeps every rendered image until it is claimed, so the unclaimed ones are released
+        if not self._claimed:
+            self._worker._discarded.append(self._task_id)
+
+
+class RenderWorker(object):
+    """
+    Process rendering the figures of the experiment from their raw arrays, so that matplotlib does not run in the
+    training loop. The tasks are processed in order, and at most max_pending of them wait in the queue before
+    submit blocks.
+    """
+
+    def __init__(self, max_pending=16):
+        self._tasks = multiprocessing.Queue(maxsize=max_pending)
+        self._results = multiprocessing.Queue()
+        self._received = dict()
+        # ids of the images dropped without being claimed, sent to the worker with the next message
+        self._discarded = []
+        self._task_ids = itertools.count()
+        self._process = multiprocessing.Process(target=_worker_loop, args=(self._tasks, self._results))
+        self._process.daemon = True
+        self._process.start()
+
+    def _send(self, command, task_id, payload=None):
+        if len(self._discarded) > 0:
+            discarded, self._discarded = self._discarded, []
+            self._tasks.put(('discard', None, discarded))
+        self._tasks.put((command, task_id, payload))
+
+    def _poll(self, task_id):
+        while task_id not in self._received:
+            try:
+                received_id, value = self._results.get_nowait()
+            except queue.Empty:
+                return False
+            self._received[received_id] = value
+        return True
+
+    def _wait(self, task_id):
+        while task_id not in self._received:
+            received_id, value = self._results.get()
+            self._received[received_id] = value
+        return self._received.pop(task_id)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        :param fn: module level function drawing a figure from the given arguments and returning it as an image array
+        :return: PendingImage
+        """
+        task_id = next(self._task_ids)
+        self._send('render', task_id, (fn, args, kwargs))
+        return PendingImage(self, task_id)
+
+    def flush(self):
+        """
+        Block until all the submitted tasks are processed, raising the first error of the images handed to the worker.
+        """
+        task_id = next(self._task_ids)
+        self._send('flush', task_id)
+        errors = self._wait(task_id)
+        if len(errors) > 0:
+            raise errors[0]
+
+    def close(self):
+        self.flush()
+        self._tasks.put(None)
+        self._process.join()
+
+
+def start_render_worker(max_pending=16):
+    """
+    Render the curriculum plots (plot_labeled_states, plot_policy_reward, test_and_plot_policy, ...) in a separate
+    process. They then return PendingImage objects, and the training loop only blocks at flush_render_worker, at
+    HTMLReport.flush, or when the image array is accessed.
+    """
+    global _worker
+    if _worker is None:
+        _worker = RenderWorker(max_pending=max_pending)
+    return _worker
+
+
+def flush_render_worker():
+    if _worker is not None:
+        _worker.flush()
+
+
+def stop_render_worker():
+    global _worker
+    if _worker is not None:
+        _worker.close()
+        _worker = None
+
+
+def render_image(fn, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs) in the render worker if it is running, otherwise right away.
+    """
+    if _worker is None:
+        return fn(*args, **kwargs)
+    return _worker.submit(fn, *args, **kwargs)
+
+
+def is_pending_image(image):
+    return isinstance(image, PendingImage)
@@ -4,11 +4,13 @@ import gc
 
 import numpy as np
 import scipy.misc
+from io import BytesIO
 from collections import OrderedDict
 
 from curriculum.state.evaluator import evaluate_states, convert_label
 from curriculum.envs.base import FixedStateGenerator
 from rllab.misc import logger
+from curriculum.logging.render_worker import render_image
 
 import matplotlib as mpl
 
@@ -42,31 +44,29 @@ def plot_policy_reward(policy, env, limit, horizon=200, max_reward=6000, fname=N
     print("Min return: {}\nMax return: {}\nMean return: {}".format(np.min(z), np.max(z), np.mean(z)))
 
     z = z.reshape(grid_shape)
+    img = render_image(_draw_policy_reward, x, y, z, max_reward, fname=fname)
+    if return_rewards:
+        return img, z
+    else:
+        return img
+
+
+def _draw_policy_reward(x, y, z, max_reward, fname=None):
     plt.figure()
     plt.clf()
     plt.pcolormesh(x, y, z, vmin=0, vmax=max_reward)
     plt.colorbar()
     if fname is not None:
         plt.savefig(fname, format='png')
-        if return_rewards:
-            return scipy.misc.imread(fname), z
-        else:
-            return scipy.misc.imread(fname)
+        plt.close('all')
+        return scipy.misc.imread(fname)
     else:
-        fp = tempfile.TemporaryFile()
-        plt.savefig(fp, format='png')
-        fp.seek(0)
-        img = scipy.misc.imread(fp)
-        fp.close()
-        if return_rewards:
-            return img, z
-        else:
-            return img
+        return save_image()
 
 
 def save_image(fig=None, fname=None):
     if fname is None:
-        fname = tempfile.TemporaryFile()
+        fname = BytesIO()
     if fig is not None:
         fig.savefig(fname)
     else:
@@ -117,6 +117,12 @@ def plot_labeled_samples(samples, sample_classes=None, text_labels=None, markers
     if markers is None:
         markers = {i: 'o' for i in text_labels.keys()}  # the keys of the text_labels are 0, 1, ...
 
+    return render_image(_draw_labeled_samples, samples, sample_classes, text_labels, markers, fname=fname, limit=limit,
+                        center=center, colors=colors, bounds=bounds, maze_id=maze_id)
+
+
+def _draw_labeled_samples(samples, sample_classes, text_labels, markers, fname=None, limit=None, center=None,
+                          colors=('r', 'g', 'b', 'm', 'k'), bounds=None, maze_id=None):
     unique_classes = list(set(sample_classes))
     assert (len(colors) > max(unique_classes))
     if center is None:
@@ -194,7 +200,7 @@ def plot_labeled_samples(samples, sample_classes=None, text_labels=None, markers
         gc.collect()
         return scipy.misc.imread(fname)
     else:
-        fp = tempfile.TemporaryFile()
+        fp = BytesIO()
         plt.savefig(fp, format='png', bbox_extra_artists=(lgd,), bbox_inches='tight')
         fp.seek(0)
         img = scipy.misc.imread(fp)
@@ -1,3 +1,5 @@
+import functools
+import math
 import multiprocessing
 import os
 import tempfile
@@ -6,7 +8,9 @@ from collections import OrderedDict
 import cloudpickle
 import time
 
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, batch_rollout, get_env_copies
+from rllab.sampler import parallel_sampler
+from rllab.sampler.stateful_pool import singleton_pool
 from rllab.misc import logger
 
 from curriculum.envs.base import FixedStateGenerator
@@ -25,11 +29,12 @@ class FunctionWrapper(object):
         self.args = args
         self.kwargs = kwargs
 
-    def __call__(self, obj):
+    def __call__(self, obj, **resident_kwargs):
+        kwargs = dict(self.kwargs, **resident_kwargs)
         if obj is None:
-            return self.func(*self.args, **self.kwargs)
+            return self.func(*self.args, **kwargs)
         else:
-            return self.func(obj, *self.args, **self.kwargs)
+            return self.func(obj, *self.args, **kwargs)
 
     def __getstate__(self):
         """ Here we overwrite the default pickle protocol to use cloudpickle. """
@@ -51,59 +56,140 @@ def disable_cuda_initializer(*args, **kwargs):
     os.environ['CUDA_VISIBLE_DEVICES'] = ''
 
 
-def parallel_map(func, iterable_object, num_processes=-1):
-    """Parallelized map function based on python process
+EVALUATION_SCOPE = 'evaluation'
+
+
+def _worker_set_env(G, env, scope=None):
+    G = parallel_sampler._get_scoped_G(G, scope)
+    G.env = cloudpickle.loads(env)
+
+
+def populate_evaluation_task(env, policy=None, scope=EVALUATION_SCOPE):
+    """ Keep env and policy resident in the persistent worker pool under the given scope.
+    The policy is only pickled and shipped when a different object is given (same caching as
+    parallel_sampler.populate_task), otherwise only its current parameters are broadcast. The env is shipped on every
+    call, as the master may have changed it (generators, kill settings, ...) since the last one.
+    """
+    if not parallel_sampler.is_populated(env, policy, scope=scope):
+        parallel_sampler.populate_task(env, policy, scope=scope)
+    elif singleton_pool.n_parallel > 1:
+        singleton_pool.run_each(_worker_set_env, [(cloudpickle.dumps(env), scope)] * singleton_pool.n_parallel)
+        if policy is not None:
+            singleton_pool.run_each(
+                parallel_sampler._worker_set_policy_params,
+                [(policy.get_param_values(), scope)] * singleton_pool.n_parallel
+            )
+
+
+def _worker_run_resident(G, func, obj, scope, resident_keys):
+    G = parallel_sampler._get_scoped_G(G, scope)
+    return func(obj, **{key: getattr(G, key) for key in resident_keys})
+
+
+def parallel_map(func, iterable_object, num_processes=-1, env=None, policy=None):
+    """Parallelized map function based on the persistent worker pool of singleton_pool
     Args:
     func: Pickleable callable object that takes one parameter.
     iterable_object: An iterable of elements to map the function on.
     num_processes: Number of process to use. When num_processes is 1,
-                   no new process will be created.
+                   no new process will be created. With -1 (or singleton_pool.n_parallel) the singleton_pool
+                   workers are reused, any other number runs a dedicated pool of that size.
+    env: optional env kept resident in the workers and given to func as the `env` keyword argument.
+    policy: optional policy kept resident in the workers and given to func as the `policy` keyword
+            argument. Only its parameter values are shipped on each call.
     Returns:
     The list resulted in calling the func on all objects in the original list.
     """
+    resident = dict()
+    if env is not None:
+        resident['env'] = env
+    if policy is not None:
+        resident['policy'] = policy
     if num_processes == 1:
-        return [func(x) for x in iterable_object]
-    if num_processes == -1:
-        from rllab.sampler.stateful_pool import singleton_pool
-        num_processes = singleton_pool.n_parallel
-    process_pool = multiprocessing.Pool(
-        num_processes,
-        initializer=disable_cuda_initializer
+        return [func(x, **resident) for x in iterable_object]
+    if num_processes != -1 and num_processes != singleton_pool.n_parallel:
+        # a pool of the requested size, shipping the env and policy with every element as before the resident workers
+        process_pool = multiprocessing.Pool(
+            num_processes,
+            initializer=disable_cuda_initializer
+        )
+        results = process_pool.map(functools.partial(_call_with_resident, func=func, **resident), iterable_object)
+        process_pool.close()
+        process_pool.join()
+        return results
+    scope = None
+    if resident:
+        scope = EVALUATION_SCOPE
+        populate_evaluation_task(env, policy, scope=scope)
+    return singleton_pool.run_map(
+        _worker_run_resident,
+        [(func, x, scope, tuple(resident.keys())) for x in iterable_object]
     )
-    results = process_pool.map(func, iterable_object)
-    process_pool.close()
-    process_pool.join()
-    return results
 
-def compute_rewards_from_paths(all_paths, key='rewards', as_goal=True, env=None, terminal_eps=0.1):
-    all_rewards = []
-    all_states = []
-    for paths in all_paths:
-        for path in paths:
-            if key == 'competence':
-                #goal = tuple(path['env_infos']['goal'][0])
-                goal_np_array = np.array(tuple(path['env_infos']['goal'][0]))
-                start_state = np.array(tuple(env.transform_to_goal_space(path['observations'][0])))
-                end_state = np.array(tuple(env.transform_to_goal_space(path['observations'][-1])))
-                final_dist = np.linalg.norm(goal_np_array - end_state)
-                initial_dist = np.linalg.norm(start_state - goal_np_array)
-                if final_dist > initial_dist:
-                    competence = -1
-                elif final_dist < terminal_eps:
-                    competence = 0
-                else:
-                    competence = -final_dist / initial_dist
-                reward = competence
-            else:
-                reward = evaluate_path(path, key=key)
 
-            if as_goal:
-                state = tuple(path['env_infos']['goal'][0])
-            else:
-                state = tuple(env.transform_to_start_space(path['observations'][0]))
+def _call_with_resident(obj, func, **resident):
+    return func(obj, **resident)
+
+
+def _path_states(paths, as_goal=True, env=None):
+    """ Stack the goal (or the start, in the env start space) of each path into a (n_paths, state_dim) array. """
+    if as_goal:
+        return np.array([path['env_infos']['goal'][0] for path in paths], dtype=float)
+    states = []
+    for path in paths:
+        env_infos_first_time_step = {key: value[0] for key, value in path['env_infos'].items()}
+        states.append(env.transform_to_start_space(path['observations'][0], env_infos_first_time_step))
+    return np.array(states, dtype=float)
+
+
+def _path_rewards(paths, key='rewards'):
+    """ Columnar evaluate_path: sum of path[key] (or path['env_infos'][key]) for every path, in a single pass. """
+    values = [path[key] if key in path else path['env_infos'][key] for path in paths]
+    if len(values) == 0:
+        return np.zeros(0)
+    lengths = np.array([len(value) for value in values], dtype=int)
+    ends = np.cumsum(lengths)
+    cumulative = np.concatenate([[0], np.cumsum(np.concatenate(values))])
+    return cumulative[ends] - cumulative[ends - lengths]
 
-            all_states.append(state)
-            all_rewards.append(reward)
+
+def _group_rows(rows):
+    """
+    Group the identical rows of a 2d float array (same equality as their tuples: 0. and -0. are merged).
+    :return: index of the first occurrence of every group, ordered by first occurrence, the group of every row, and the
+    size of every group
+    """
+    rows = np.ascontiguousarray(rows, dtype=float) + 0.
+    # one opaque bytes key per row, as np.unique has no axis argument before numpy 1.13
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first_index, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first_index[order], rank[inverse], counts[order]
+
+
+def compute_rewards_from_paths(all_paths, key='rewards', as_goal=True, env=None, terminal_eps=0.1):
+    """
+    :return: the state (goal or start) of every path, as an (n_paths, state_dim) array, and its reward
+    """
+    paths = [path for paths in all_paths for path in paths]
+    if key == 'competence':
+        goals = _path_states(paths, as_goal=True)
+        start_states = np.array([env.transform_to_goal_space(path['observations'][0]) for path in paths], dtype=float)
+        end_states = np.array([env.transform_to_goal_space(path['observations'][-1]) for path in paths], dtype=float)
+        final_dists = np.linalg.norm(goals - end_states, axis=-1)
+        initial_dists = np.linalg.norm(start_states - goals, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            all_rewards = np.where(final_dists > initial_dists, -1.,
+                                   np.where(final_dists < terminal_eps, 0., -final_dists / initial_dists))
+    else:
+        all_rewards = _path_rewards(paths, key=key)
+
+    if as_goal:
+        all_states = _path_states(paths, as_goal=True)
+    else:
+        all_states = np.array([env.transform_to_start_space(path['observations'][0]) for path in paths], dtype=float)
 
     return [all_states, all_rewards]
 
@@ -111,39 +197,33 @@ def compute_rewards_from_paths(all_paths, key='rewards', as_goal=True, env=None,
 def label_states_from_paths(all_paths, min_reward=0, max_reward=1, key='rewards', as_goal=True,
                  old_rewards=None, improvement_threshold=0, n_traj=1, env=None, return_mean_rewards = False,
                             order_of_states = None):
-    state_dict = {}
-    for paths in all_paths:
-        for path in paths:
-            reward = evaluate_path(path, key=key)
-            if as_goal:
-                state = tuple(path['env_infos']['goal'][0])
-            else:
-                env_infos_first_time_step = {key: value[0] for key, value in path['env_infos'].items()}
-                state = tuple(env.transform_to_start_space(path['observations'][0], env_infos_first_time_step))
-            if state in state_dict:
-                state_dict[state].append(reward)
-            else:
-                state_dict[state] = [reward]
-
-    states = []
-    unlabeled_state = []
-    mean_rewards = []
+    paths = [path for paths in all_paths for path in paths]
+    path_states = _path_states(paths, as_goal=as_goal, env=env)
+    path_rewards = _path_rewards(paths, key=key)
+    if len(paths) > 0:
+        first_index, groups, counts = _group_rows(path_states.reshape((len(paths), -1)))
+        group_mean_rewards = np.bincount(groups, weights=path_rewards, minlength=len(counts)) / counts
+    else:
+        first_index, counts, group_mean_rewards = [np.zeros(0, dtype=int)] * 3
 
     if order_of_states is None:
-        for state, rewards in state_dict.items():
-            if len(rewards) >= n_traj:
-                states.append(list(state))
-                mean_rewards.append(np.mean(rewards))
+        labeled = counts >= n_traj
+        states = path_states[first_index[labeled]] if len(paths) > 0 else []
+        mean_rewards = group_mean_rewards[labeled]
     # case where you want states returned in a specific order (useful for TSCL)
     else:
+        group_of_state = {(path_states[i] + 0.).tobytes(): group for group, i in enumerate(first_index)}
+        states = []
+        mean_rewards = []
         updated = []
         for state in order_of_states:
             states.append(state)
-            if state not in state_dict or len(state_dict[tuple(state)]) < n_traj:
+            group = group_of_state.get((np.asarray(state, dtype=float).reshape(-1) + 0.).tobytes())
+            if group is None or counts[group] < n_traj:
                 mean_rewards.append(0)
                 updated.append(False)
             else:
-                mean_rewards.append(np.mean(state_dict[tuple(state)]))
+                mean_rewards.append(group_mean_rewards[group])
                 updated.append(True)
 
     # Make this a vertical list.
@@ -161,16 +241,42 @@ def label_states_from_paths(all_paths, min_reward=0, max_reward=1, key='rewards'
 
 
 def label_states(states, env, policy, horizon, as_goals=True, min_reward=0.1, max_reward=0.9, key='rewards',
-                 old_rewards=None, improvement_threshold=0.1, n_traj=1, n_processes=-1, full_path=False, return_rew=False):
+                 old_rewards=None, improvement_threshold=0.1, n_traj=1, n_processes=-1, full_path=False, return_rew=False,
+                 n_envs=1, adaptive=False, round_traj=1, confidence_z=1.64, reward_range=None, return_n_traj=False):
+    """
+    :param adaptive: evaluate the states with evaluate_states_adaptive, running at most n_traj rollouts per state but
+    stopping early the states whose label is settled. round_traj, confidence_z and reward_range are only used then.
+    :param reward_range: bounds of the summed key of a rollout. Required with key='rewards', as the env rewards may be
+    shaped or negative; the other keys (success indicators in env_infos) default to (0, 1).
+    :param return_n_traj: also return the number of rollouts used per state
+    """
     logger.log("Labelling starts")
-    result = evaluate_states(
-        states, env, policy, horizon, as_goals=as_goals,
-        n_traj=n_traj, n_processes=n_processes, key=key, full_path=full_path
-    )
-    if full_path:
-        mean_rewards, paths = result
+    if adaptive:
+        if reward_range is None:
+            if key == 'rewards':
+                raise ValueError("label_states with adaptive=True and key='rewards' needs the reward_range of the "
+                                 "rollouts")
+            reward_range = (0., 1.)
+        result = evaluate_states_adaptive(
+            states, env, policy, horizon, as_goals=as_goals, n_traj=n_traj, min_reward=min_reward,
+            max_reward=max_reward, round_traj=round_traj, confidence_z=confidence_z, reward_range=reward_range,
+            n_processes=n_processes, key=key, full_path=full_path, n_envs=n_envs
+        )
+        if full_path:
+            mean_rewards, n_rollouts, paths = result
+        else:
+            mean_rewards, n_rollouts = result
+        logger.log("Adaptive evaluation used {} rollouts out of {}".format(np.sum(n_rollouts), n_traj * len(states)))
     else:
-        mean_rewards = result
+        result = evaluate_states(
+            states, env, policy, horizon, as_goals=as_goals,
+            n_traj=n_traj, n_processes=n_processes, key=key, full_path=full_path, n_envs=n_envs
+        )
+        if full_path:
+            mean_rewards, paths = result
+        else:
+            mean_rewards = result
+        n_rollouts = n_traj * np.ones(len(states), dtype=int)
     logger.log("Evaluated states.")
 
     mean_rewards = mean_rewards.reshape(-1, 1)
@@ -179,10 +285,16 @@ def label_states(states, env, policy, horizon, as_goals=True, min_reward=0.1, ma
     logger.log("Starts labelled")
 
     if full_path:
-        return labels, paths
+        result = [labels, paths]
     elif return_rew:
-        return labels, mean_rewards
-    return labels
+        result = [labels, mean_rewards]
+    else:
+        result = [labels]
+    if return_n_traj:
+        result.append(n_rollouts)
+    if len(result) == 1:
+        return labels
+    return tuple(result)
 
 
 def compute_labels(mean_rewards, old_rewards=None, min_reward=0.1, max_reward=0.9, improvement_threshold=0.1):
@@ -241,11 +353,19 @@ def convert_label(labels):
 
 def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full_path=False, key='rewards',
                     as_goals=True,
-                    aggregator=(np.sum, np.mean)):
+                    aggregator=(np.sum, np.mean), n_envs=1):
+    """
+    :param n_envs: if larger than 1, each worker evaluates states in chunks of n_envs, stepping one env copy per
+    state in lockstep and querying the policy once per timestep for the whole chunk (see batch_rollout).
+    """
+    if n_envs > 1:
+        evaluate_func = evaluate_state_batch
+        items = [states[i:i + n_envs] for i in range(0, len(states), n_envs)]
+    else:
+        evaluate_func = evaluate_state
+        items = states
     evaluate_state_wrapper = FunctionWrapper(
-        evaluate_state,
-        env=env,
-        policy=policy,
+        evaluate_func,
         horizon=horizon,
         n_traj=n_traj,
         full_path=full_path,
@@ -255,15 +375,107 @@ def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full
     )
     result = parallel_map(  # if full_path this is a list of tuples
         evaluate_state_wrapper,
-        states,
+        items,
         n_processes,
+        env=env,
+        policy=policy,
     )
+    if n_envs > 1:
+        result = [state_result for batch_result in result for state_result in batch_result]
 
     if full_path:
         return np.array([state[0] for state in result]), [path for state in result for path in state[1]]
     return np.array(result)
 
 
+def mean_confidence_interval(reward_sums, n_rollouts, confidence_z=1.64, reward_range=(0., 1.), binary=True):
+    """
+    Confidence interval of the mean of rewards bounded in reward_range. For binary rewards (only the two bounds of
+    reward_range, e.g. success indicators) it is the Wilson score interval, which unlike the normal approximation does
+    not collapse when all the rollouts of a state got the same reward. Otherwise it is the (wider) Hoeffding interval
+    with the same two-sided confidence level, valid for any reward in reward_range. States without rollouts get the
+    whole reward_range.
+    """
+    low, high = reward_range
+    scale = float(high - low)
+    n_rollouts = np.asarray(n_rollouts, dtype=float)
+    reward_sums = np.asarray(reward_sums, dtype=float)
+    has_rollouts = n_rollouts > 0
+    n = np.where(has_rollouts, n_rollouts, 1.)
+    p = (reward_sums / n - low) / scale
+    if binary:
+        z2 = confidence_z ** 2
+        denominator = 1 + z2 / n
+        center = (p + z2 / (2 * n)) / denominator
+        half_width = confidence_z * np.sqrt(p * (1 - p) / n + z2 / (4 * n ** 2)) / denominator
+    else:
+        delta = math.erfc(confidence_z / math.sqrt(2))
+        center = p
+        half_width = np.sqrt(np.log(2 / delta) / (2 * n))
+    interval_low = np.where(has_rollouts, np.maximum(center - half_width, 0.), 0.)
+    interval_high = np.where(has_rollouts, np.minimum(center + half_width, 1.), 1.)
+    return low + scale * interval_low, low + scale * interval_high
+
+
+def evaluate_states_adaptive(states, env, policy, horizon, n_traj=1, min_reward=0.1, max_reward=0.9, round_traj=1,
+                             confidence_z=1.64, reward_range=(0., 1.), n_processes=-1, full_path=False,
+                             key='rewards', as_goals=True, aggregator=np.sum, n_envs=1):
+    """
+    Sequential version of evaluate_states: the rollouts are run in rounds of round_traj per state, and after each round
+    a state stops being evaluated once the confidence interval of its mean reward lies entirely below min_reward,
+    above max_reward or between them, i.e. once its label is settled. At most n_traj rollouts are run per state.
+    :param aggregator: aggregates a path into its reward, the rewards of the rollouts of a state are averaged
+    :param reward_range: bounds of the aggregated reward of a rollout, see mean_confidence_interval. A ValueError is
+    raised if a rollout falls outside of them. As long as all the rollouts hit one of the bounds (success indicators)
+    the Wilson interval is used, otherwise the Hoeffding one.
+    :return: mean rewards and number of rollouts used per state (and the list of paths, grouped by state, if full_path)
+    """
+    n_states = len(states)
+    reward_sums = np.zeros(n_states)
+    n_rollouts = np.zeros(n_states, dtype=int)
+    state_paths = [[] for _ in range(n_states)]
+    active = np.arange(n_states) if n_traj > 0 else np.arange(0)
+    binary = True
+    while len(active) > 0:
+        # all the active states have run the same number of rollouts
+        round_size = min(round_traj, n_traj - n_rollouts[active[0]])
+        result = evaluate_states(
+            [states[i] for i in active], env, policy, horizon, n_traj=round_size, n_processes=n_processes,
+            full_path=full_path, key=key, as_goals=as_goals, aggregator=(aggregator, np.array), n_envs=n_envs
+        )
+        if full_path:
+            rewards, paths = result
+            for k, i in enumerate(active):
+                state_paths[i].extend(paths[k * round_size:(k + 1) * round_size])
+        else:
+            rewards = result
+        rewards = np.asarray(rewards, dtype=float).reshape((len(active), round_size))
+        if np.any(rewards < reward_range[0]) or np.any(rewards > reward_range[1]):
+            raise ValueError("rollout rewards in [{}, {}] are outside of reward_range {}".format(
+                np.min(rewards), np.max(rewards), reward_range))
+        binary = binary and np.all((rewards == reward_range[0]) | (rewards == reward_range[1]))
+        reward_sums[active] += np.sum(rewards, axis=1)
+        n_rollouts[active] += round_size
+
+        low, high = mean_confidence_interval(reward_sums[active], n_rollouts[active], confidence_z, reward_range,
+                                             binary=binary)
+        settled = (high <= min_reward) | (low >= max_reward) | ((low > min_reward) & (high < max_reward))
+        active = active[np.logical_not(settled) & (n_rollouts[active] < n_traj)]
+
+    # states without rollouts (n_traj <= 0) get a NaN mean reward, as evaluate_states would
+    mean_rewards = np.full(n_states, np.nan)
+    np.divide(reward_sums, n_rollouts, out=mean_rewards, where=n_rollouts > 0)
+    if full_path:
+        return mean_rewards, n_rollouts, [path for paths in state_paths for path in paths]
+    return mean_rewards, n_rollouts
+
+
+def _aggregate_path(path, key, aggregator):
+    if key in path:
+        return aggregator(path[key])
+    return aggregator(path['env_infos'][key])
+
+
 def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='rewards', as_goals=True,
                    aggregator=(np.sum, np.mean)):
     aggregated_data = []
@@ -275,15 +487,7 @@ def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='
 
     for j in range(n_traj):
         paths.append(rollout(env, policy, horizon))
-
-        if key in paths[-1]:
-            aggregated_data.append(
-                aggregator[0](paths[-1][key])
-            )
-        else:
-            aggregated_data.append(
-                aggregator[0](paths[-1]['env_infos'][key])
-            )
+        aggregated_data.append(_aggregate_path(paths[-1], key, aggregator[0]))
 
     mean_reward = aggregator[1](aggregated_data)
 
@@ -293,17 +497,47 @@ def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='
     return mean_reward
 
 
+def evaluate_state_batch(states, env, policy, horizon, n_traj=1, full_path=False, key='rewards', as_goals=True,
+                         aggregator=(np.sum, np.mean)):
+    """ Same as evaluate_state for a list of states, rolling out one env copy per state in lockstep. """
+    # only copies are used, as updating the generators of env itself would invalidate its cached copies
+    envs = get_env_copies(env, len(states) + 1)[1:]
+    for state, state_env in zip(states, envs):
+        if as_goals:
+            state_env.update_goal_generator(FixedStateGenerator(state))
+        else:
+            state_env.update_start_generator(FixedStateGenerator(state))
+
+    paths = [[] for _ in states]
+    for j in range(n_traj):
+        for state_paths, path in zip(paths, batch_rollout(envs, policy, horizon)):
+            state_paths.append(path)
+
+    results = []
+    for state_paths in paths:
+        mean_reward = aggregator[1]([_aggregate_path(path, key, aggregator[0]) for path in state_paths])
+        if full_path:
+            results.append((mean_reward, state_paths))
+        else:
+            results.append(mean_reward)
+    return results
+
+
 def evaluate_state_env(env, policy, horizon, n_states=10, n_traj=1, n_processes=-1, **kwargs):
     evaluate_env_wrapper = FunctionWrapper(
-        rollout,
-        env=env, agent=policy, max_path_length=horizon,
+        rollout_policy,
+        max_path_length=horizon,
     )
-    paths = parallel_map(evaluate_env_wrapper, [None] * n_states, n_processes)
+    paths = parallel_map(evaluate_env_wrapper, [None] * n_states, n_processes, env=env, policy=policy)
 
     # paths = [rollout(env=env, agent=policy, max_path_length=horizon) for _ in range(n_states)]
     env.log_diagnostics(paths, n_traj=n_traj, **kwargs)
 
 
+def rollout_policy(env, policy, max_path_length):
+    return rollout(env, policy, max_path_length)
+
+
 def evaluate_path(path, full_path=False, key='rewards', aggregator=np.sum):
     if not full_path:
         if key in path:
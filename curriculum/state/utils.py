@@ -1,5 +1,5 @@
 import multiprocessing
-from rllab.sampler.stateful_pool import singleton_pool
+import heapq
 import scipy.spatial
 import random
 from rllab import spaces
@@ -15,157 +15,262 @@ import matplotlib.pyplot as plt
 
 import numpy as np
 import scipy.misc
-from curriculum.state.evaluator import parallel_map, disable_cuda_initializer
+
+
+class StateIndex(object):
+    """
+    Incremental nearest-neighbor index over a growing set of points. The points are kept in cKDTree blocks of
+    geometrically decreasing size (each block is more than twice as large as the next one), so appending k points
+    costs O(k log^2 n) amortized and a query only visits O(log n) trees.
+    """
+
+    def __init__(self):
+        self.blocks = []
+
+    @property
+    def size(self):
+        return sum(block.n for block in self.blocks)
+
+    def add(self, points):
+        points = np.asarray(points, dtype=float)
+        if len(points) == 0:
+            return
+        while len(self.blocks) > 0 and self.blocks[-1].n <= 2 * len(points):
+            points = np.concatenate([self.blocks.pop().data, points])
+        self.blocks.append(scipy.spatial.cKDTree(points))
+
+    def min_distances(self, points, distance_upper_bound=np.inf):
+        """ Distance of each point to its nearest indexed point, inf if there is none within distance_upper_bound """
+        dists = np.full(len(points), np.inf)
+        for block in self.blocks:
+            block_dists, _ = block.query(points, k=1, distance_upper_bound=distance_upper_bound)
+            dists = np.minimum(dists, block_dists)
+        return dists
+
+
+def select_distant_points(points, distance_threshold):
+    """ Boolean mask greedily keeping the points at more than distance_threshold from all the previously kept ones """
+    keep = np.zeros(len(points), dtype=bool)
+    neighbors = scipy.spatial.cKDTree(points).query_ball_point(points, r=distance_threshold)
+    for i, neighbor_idx in enumerate(neighbors):
+        keep[i] = not np.any(keep[neighbor_idx])
+    return keep
 
 
 class StateCollection(object):
-    """ A collection of states, with minimum distance threshold for new states. """
+    """
+    A collection of states, with minimum distance threshold for new states. The states are stored in a preallocated
+    array that grows geometrically, so that appending and sampling do not copy the whole collection.
+    """
 
     def __init__(self, distance_threshold=None, states_transform = None, idx_lim=None):
         self.distance_threshold = distance_threshold
-        self.state_list = []
         self.states_transform = states_transform
         self.idx_lim = idx_lim
-        if self.states_transform:
-            self.transformed_state_list = []
+        assert self.states_transform is None or self.idx_lim is None, \
+            "Can't use state transform and idx_lim with StateCollection!"
+        self.empty()
 
     @property
     def size(self):
-        return len(self.state_list)
+        return self._size
 
     def empty(self):
-        self.state_list = []
+        self._states = None
+        self._size = 0
+        self.index = StateIndex()
 
     def sample(self, size, replace=False, replay_noise=0):
-        states = sample_matrix_row(np.array(self.state_list), size, replace)
+        states = sample_matrix_row(self.states, size, replace)
         if replay_noise > 0:
-            states += replay_noise * np.random.randn(*states.shape)
+            states = states + replay_noise * np.random.randn(*states.shape)
         return states
 
-    def append(self, states, n_process=None):
+    def _index_points(self, states):
+        """ Points used for the distance checks: the transformed states, or their first idx_lim coordinates """
         if self.states_transform:
-            return self.append_states_transform(states)
+            return np.asarray(self.states_transform(states), dtype=float)
+        return states[:, :self.idx_lim]
+
+    def _get_index(self):
+        if self.index is None:  # not rebuilt yet since unpickling
+            self.index = StateIndex()
+            if self._size > 0:
+                self.index.add(self._index_points(self.states))
+        return self.index
+
+    def _extend(self, states):
+        if self._states is None:
+            self._states = np.empty((max(len(states), 16),) + states.shape[1:])
+        elif self._size + len(states) > len(self._states):
+            capacity = max(2 * len(self._states), self._size + len(states))
+            new_states = np.empty((capacity,) + self._states.shape[1:])
+            new_states[:self._size] = self._states[:self._size]
+            self._states = new_states
+        self._states[self._size:self._size + len(states)] = states
+        self._size += len(states)
+
+    def append(self, states, n_process=None):
+        """
+        Append the states at more than distance_threshold from each other and from the states already in the
+        collection. n_process is only kept for backwards compatibility: the filtering is done in-process on the index.
+        :return: the added states
+        """
+        states = np.array(states)
         if len(states) > 0:
-            states = np.array(states)
             logger.log("we are trying to append states: {}".format(states.shape))
             if self.distance_threshold is not None and self.distance_threshold > 0:
-                states = self._process_states(states)
+                points = self._index_points(states)
+                keep = select_distant_points(points, self.distance_threshold)
+                dists = self._get_index().min_distances(
+                    points[keep], distance_upper_bound=np.nextafter(self.distance_threshold, np.inf))
+                keep[keep] = dists > self.distance_threshold
+                states = states[keep]
+                self.index.add(points[keep])
             logger.log("after processing, we are left with : {}".format(states.shape))
-            if n_process is None:
-                n_process = singleton_pool.n_parallel
-            elif n_process in [-1, 0]:
-                n_process = 1
-            if states.shape[0] >= n_process > 1:
-                states_per_process = states.shape[0] // singleton_pool.n_parallel
-                list_of_states = [states[i * states_per_process: (i+1) * states_per_process, :] for i in range(n_process-1)]
-                list_of_states.append(states[states_per_process * (n_process - 1):, :])
-                states = parallel_map(self._select_states, list_of_states)
-                states = np.concatenate(states)
-            else:
-                states = self._select_states(states)
-            self.state_list.extend(states.tolist())
-            return states
-
-    def _select_states(self, states):
-        # print('selecting states from shape: ', states.shape)
-        selected_states = states
-        selected_states_idx_lim = np.array([state[:self.idx_lim] for state in states])
-        # print('selecting states from shape (after idx_lim of ', self.idx_lim, ': ', selected_states_idx_lim.shape)
-        state_list_idx_lim = np.array([state[:self.idx_lim] for state in self.state_list])
-        # print('the state_list_idx_lim shape: ', np.shape(self.state_list))
-        if self.distance_threshold is not None and self.distance_threshold > 0:
-            if len(self.state_list) > 0:
-                dists = scipy.spatial.distance.cdist(state_list_idx_lim, selected_states_idx_lim)
-                indices = np.amin(dists, axis=0) > self.distance_threshold
-                selected_states = selected_states[indices, :]
-        # print('the selected states are: {}'.format(selected_states.shape))
-        return selected_states
-
-    def _process_states(self, states):
-        "keep only the states that are at more than dist_threshold from each other"
-        # adding a states transform allows you to maintain full state information while possibly disregarding some dim
-        states = np.array(states)
-        results = [states[0]]
-        results_idx_lim = [states[0][:self.idx_lim]]
-        for i, state in enumerate(states[1:]):
-            # print("analyzing state : ", i)
-            if np.amin(scipy.spatial.distance.cdist(results_idx_lim, state.reshape(1, -1)[:self.idx_lim])) > self.distance_threshold:
-                results.append(state)
-                results_idx_lim.append(state[:self.idx_lim])
-        return np.array(results)
-
-    def _process_states_transform(self, states, transformed_states):
-        "keep only the states that are at more than dist_threshold from each other"
-        # adding a states transform allows you to maintain full state information while possibly disregarding some dim
-        results = [states[0]]
-        transformed_results = [transformed_states[0]]
-        for i in range(1, len(states)):
-            # checks if valid in transformed space
-            if np.amin(scipy.spatial.distance.cdist(transformed_results, transformed_states[i].reshape(1, -1))) > self.distance_threshold:
-                results.append(states[i])
-                transformed_results.append(transformed_states[i])
-        return np.array(results), np.array(transformed_results)
-
-    def append_states_transform(self, states):
-        assert self.idx_lim is None, "Can't use state transform and idx_lim with StateCollection!"
-        if len(states) > 0:
-            states = np.array(states)
-            transformed_states = self.states_transform(states)
-            if self.distance_threshold is not None and self.distance_threshold > 0:
-                states, transformed_states = self._process_states_transform(states, transformed_states)
-                if len(self.state_list) > 0:
-                    print("hi")
-                    dists = scipy.spatial.distance.cdist(self.transformed_state_list, transformed_states)
-                    indices = np.amin(dists, axis=0) > self.distance_threshold
-                    states = states[indices, :]
-                    transformed_states = transformed_states[indices, :]
-            self.state_list.extend(states)
-            self.transformed_state_list.extend(transformed_states)
-            assert(len(self.state_list) == len(self.transformed_state_list))
-        return states # modifed to return added states
-
-    # def append(self, states):
-    #     if self.states_transform:
-    #         return self.append_states_transform(states)
-    #     if len(states) > 0:
-    #         states = np.array(states)
-    #         if self.distance_threshold is not None and self.distance_threshold > 0:
-    #             states = self._process_states(states)
-    #             if len(self.state_list) > 0:
-    #                 dists = scipy.spatial.distance.cdist(self.state_list, states)
-    #                 indices = np.amin(dists, axis=0) > self.distance_threshold
-    #                 states = states[indices, :]
-    #         self.state_list.extend(states)
-    #     return states # modifed to return added states
+            if len(states) > 0:
+                self._extend(states)
+        return states
 
     @property
     def states(self):
-        return np.array(self.state_list)
+        """ Read-only view of the states in the collection """
+        if self._states is None:
+            return np.array([])
+        states = self._states[:self._size]
+        states.flags.writeable = False
+        return states
+
+    @property
+    def state_list(self):
+        """ The states as a list of lists, kept for backwards compatibility """
+        return self.states.tolist()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        if self._states is not None:
+            d['_states'] = self._states[:self._size]  # only the filled rows are pickled
+        d['index'] = None  # rebuilt lazily on the next append
+        return d
+
+    def __setstate__(self, d):
+        if 'state_list' in d:  # collections pickled with the former list storage
+            state_list = d.pop('state_list')
+            d.pop('transformed_state_list', None)
+            d['_states'] = np.array(state_list, dtype=float) if len(state_list) > 0 else None
+            d['_size'] = len(state_list)
+            d['index'] = None
+        self.__dict__.update(d)
+
+class IndexedMaxHeap(object):
+    """
+    Binary max-heap of items with a position map: pushing an item or updating its priority is O(log n), and the k
+    items with the highest priority are found in O(k log k) without modifying the heap.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.position = {}
+        self.priority = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, item, priority):
+        self.priority[item] = priority
+        self.position[item] = len(self.heap)
+        self.heap.append(item)
+        self._sift_up(len(self.heap) - 1)
+
+    def update(self, item, priority):
+        old_priority = self.priority[item]
+        self.priority[item] = priority
+        if priority > old_priority:
+            self._sift_up(self.position[item])
+        else:
+            self._sift_down(self.position[item])
+
+    def top(self, k):
+        """ The (at most) k items with the highest priority, in decreasing order of priority """
+        top_items = []
+        frontier = [(-self.priority[self.heap[0]], 0)] if len(self.heap) > 0 else []
+        while len(frontier) > 0 and len(top_items) < k:
+            _, i = heapq.heappop(frontier)
+            top_items.append(self.heap[i])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (-self.priority[self.heap[child]], child))
+        return top_items
+
+    def _swap(self, i, j):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.position[self.heap[i]] = i
+        self.position[self.heap[j]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.priority[self.heap[parent]] >= self.priority[self.heap[i]]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        while True:
+            largest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.heap) and self.priority[self.heap[child]] > self.priority[self.heap[largest]]:
+                    largest = child
+            if largest == i:
+                return
+            self._swap(i, largest)
+            i = largest
+
 
 class SmartStateCollection(StateCollection):
+    """
+    State collection keeping a Q value per state. The rows of the states are looked up through a hash map and the
+    priorities (|Q| or Q) live in an indexed max-heap, so Q updates are O(log n) and the top-k sampling O(k log k).
+    """
     # should be used same as before, just need to update Q values
     #TODO: update alpha smartly
     def __init__(self, eps = 0.5, alpha = 0.3, abs = True, *args, **kwargs):
         self.eps = eps # percentage of random
         self.alpha = alpha
         self.abs = abs
-        self.q_vals = {} #TODO: smarter way to keep list sorted, maybe priority queue?
-        # use heapq https://stackoverflow.com/questions/7197315/5-maximum-values-in-a-python-dictionary if slow
-        self.prev_vals = {}
         super(SmartStateCollection, self).__init__(*args, **kwargs)
 
+    def empty(self):
+        super(SmartStateCollection, self).empty()
+        self.rows = {}  # state key -> row of the state in the collection
+        self.q_vals = []
+        self.prev_vals = []
+        self.priorities = IndexedMaxHeap()
+
+    @staticmethod
+    def _state_key(state):
+        # + 0. turns -0. into 0., which compare equal but differ in bytes
+        return (np.asarray(state, dtype=float) + 0.).tobytes()
+
+    def _priority(self, q_val):
+        return abs(q_val) if self.abs else q_val
+
+    def _add_row(self, row, state, q_val, prev_val):
+        self.rows[self._state_key(state)] = row
+        self.q_vals.append(q_val)
+        self.prev_vals.append(prev_val)
+        self.priorities.push(row, self._priority(q_val))
+
     def update_starts(self, states, rewards, only_good = True, logger = None):
         old_states, old_rewards, new_states, new_rewards = [], [], [], []
-        for i in range(len(states)):
-            state = states[i]
-            reward = rewards[i]
+        for state, reward in zip(states, rewards):
             if only_good:
                 # TODO: set option
                 # intuition is that we don't want states that we already master
                 if reward < 0.02 or reward > 0.98:
                     continue
             # check if state shows up
-            if len(self.state_list) > 0 and np.sum(np.all(state == self.state_list, axis = 1)) > 0:
+            if self._state_key(state) in self.rows:
                 old_states.append(state)
                 old_rewards.append(reward)
             else:
@@ -177,29 +282,24 @@ class SmartStateCollection(StateCollection):
         self.update_q(old_states, old_rewards)
 
     def append(self, states, rewards):
-        zero_index = 0 # check on np.argmax
+        # first occurrence of each state among the given ones
+        reward_idx = {self._state_key(state): i for i, state in reversed(list(enumerate(states)))}
         added_states = super(SmartStateCollection, self).append(states)
-        for state in added_states:
-            index = np.argmax(np.all(states == state, axis =1)) # should only get one index
-            if index == 0:
-                zero_index += 1
-            reward = rewards[index]
-            self.q_vals[tuple(state)] = self.alpha * reward # TODO: not sure what the initialization should be, is there alpha term?
-            self.prev_vals[tuple(state)] = reward
-        assert (zero_index < 2)
+        first_row = self.size - len(added_states)
+        for row, state in enumerate(added_states, first_row):
+            reward = rewards[reward_idx[self._state_key(state)]]
+            # TODO: not sure what the initialization should be, is there alpha term?
+            self._add_row(row, state, self.alpha * reward, reward)
+        return added_states
 
     def sample(self, size, replace=False, replay_noise=0):
         size_random_samples = int(size * self.eps)
         size_good_samples = size - size_random_samples
         print("Random starts: {}".format(size_random_samples))
-        states = sample_matrix_row(np.array(self.state_list), size_random_samples, replace)
+        states = sample_matrix_row(self.states, size_random_samples, replace)
         if size_good_samples == 0:
             return states # fully uniform states
-        if self.abs:
-            good_states = sorted(self.q_vals, key= lambda k: abs(self.q_vals[k]), reverse=True)[:size_good_samples]
-        else:
-            good_states = sorted(self.q_vals, key=self.q_vals.get, reverse=True)[:size_good_samples]
-        good_states = np.array(good_states)
+        good_states = self.states[self.priorities.top(size_good_samples)]
         return np.concatenate((states, good_states))
         # if replay_noise > 0:
         #     states += replay_noise * np.random.randn(*states.shape)
@@ -207,22 +307,23 @@ class SmartStateCollection(StateCollection):
 
     def update_q(self, states, rewards):
         # updated should be true if there are enough samples
-        previous_values = np.array([self.prev_vals[tuple(state)] for state in states])
-        curr_q_values =  np.array([self.q_vals[tuple(state)] for state in states])
-        improvement = rewards - previous_values
-        new_values = self.alpha * improvement + (1 - self.alpha) * curr_q_values
-
-        for i in range(len(states)):
-            # if updated[i]:
-            self.q_vals[tuple(states[i])] = new_values[i]
-            self.prev_vals[tuple(states[i])] = rewards[i]
-
-
-
-
-
-
-
+        for state, reward in zip(states, rewards):
+            row = self.rows[self._state_key(state)]
+            improvement = reward - self.prev_vals[row]
+            q_val = self.alpha * improvement + (1 - self.alpha) * self.q_vals[row]
+            self.q_vals[row] = q_val
+            self.prev_vals[row] = reward
+            self.priorities.update(row, self._priority(q_val))
+
+    def __setstate__(self, d):
+        super(SmartStateCollection, self).__setstate__(d)
+        if isinstance(self.q_vals, dict):  # pickled with the former dicts keyed by state tuples
+            q_vals, prev_vals = self.q_vals, self.prev_vals
+            self.rows, self.q_vals, self.prev_vals, self.priorities = {}, [], [], IndexedMaxHeap()
+            for row, state in enumerate(self.states):
+                self._add_row(row, state, q_vals.get(tuple(state), 0.), prev_vals.get(tuple(state), 0.))
+        else:  # the keys of collections pickled before -0. and 0. shared one
+            self.rows = {self._state_key(state): row for row, state in enumerate(self.states)}
 
 
 def sample_matrix_row(M, size, replace=False):
@@ -231,7 +332,7 @@ def sample_matrix_row(M, size, replace=False):
     if replace:
         indices = np.random.randint(0, M.shape[0], size)
     else:
-        indices = np.random.choice(M.shape[0], size, replace=replace)
+        indices = random.sample(range(M.shape[0]), size)  # O(size), np.random.choice permutes all the rows
     return M[indices, :]
 
 
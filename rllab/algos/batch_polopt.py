@@ -7,17 +7,33 @@ from rllab.policies.base import Policy
 
 
 class BatchSampler(BaseSampler):
-    def __init__(self, algo):
+    def __init__(self, algo, n_envs=1, persistent_workers=False, shared_memory=False):
         """
         :type algo: BatchPolopt
+        :param n_envs: number of env copies each worker steps in lockstep with batched policy queries
+        :param persistent_workers: keep the env and policy populated in the workers after training. A later sampler
+        on the same env and policy then only broadcasts the env start/goal generators instead of re-populating.
+        :param shared_memory: transport the collected paths from the workers through shared memory files
         """
         self.algo = algo
+        self.n_envs = n_envs
+        self.persistent_workers = persistent_workers
+        self.shared_memory = shared_memory
 
     def start_worker(self):
-        parallel_sampler.populate_task(self.algo.env, self.algo.policy, scope=self.algo.scope)
+        if self.persistent_workers and parallel_sampler.is_populated(self.algo.env, self.algo.policy,
+                                                                     scope=self.algo.scope):
+            for generator_name, update_method in [('start_generator', 'update_start_generator'),
+                                                  ('goal_generator', 'update_goal_generator')]:
+                if hasattr(self.algo.env, generator_name):
+                    parallel_sampler.update_env_generator(getattr(self.algo.env, generator_name),
+                                                          update_method=update_method, scope=self.algo.scope)
+        else:
+            parallel_sampler.populate_task(self.algo.env, self.algo.policy, scope=self.algo.scope)
 
     def shutdown_worker(self):
-        parallel_sampler.terminate_task(scope=self.algo.scope)
+        if not self.persistent_workers:
+            parallel_sampler.terminate_task(scope=self.algo.scope)
 
     def obtain_samples(self, itr):
         cur_params = self.algo.policy.get_param_values()
@@ -26,6 +42,8 @@ class BatchSampler(BaseSampler):
             max_samples=self.algo.batch_size,
             max_path_length=self.algo.max_path_length,
             scope=self.algo.scope,
+            n_envs=self.n_envs,
+            shared_memory=self.shared_memory,
         )
         if self.algo.whole_paths:
             return paths
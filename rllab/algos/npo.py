@@ -4,9 +4,31 @@ from rllab.algos.batch_polopt import BatchPolopt
 import rllab.misc.logger as logger
 import theano
 import theano.tensor as TT
+import cloudpickle
+import numpy as np
+from rllab.core.serializable import Serializable
 from rllab.optimizers.penalty_lbfgs_optimizer import PenaltyLbfgsOptimizer
 
 
+def _space_signature(space):
+    # Box hashes its low/high arrays, which fails, so boxes are identified by their bounds
+    if hasattr(space, 'low') and hasattr(space, 'high'):
+        return type(space), np.asarray(space.low).tobytes(), np.asarray(space.high).tobytes(), np.shape(space.low)
+    return space
+
+
+def _compiled_optimizers(policy):
+    """
+    {signature of the optimization problem: optimizer whose functions are compiled for it} of the policy. The cache is
+    an attribute of the policy rather than a module level mapping: the optimizers reference their policy, so a global
+    mapping (even a WeakKeyDictionary) would keep every policy and its compiled functions alive, whereas here they
+    are collected with the policy. It is not part of the pickled state of the policy.
+    """
+    if '_compiled_optimizers' not in policy.__dict__:
+        policy._compiled_optimizers = dict()
+    return policy._compiled_optimizers
+
+
 class NPO(BatchPolopt):
     """
     Natural Policy Optimization.
@@ -18,8 +40,14 @@ class NPO(BatchPolopt):
             optimizer_args=None,
             step_size=0.01,
             truncate_local_is_ratio=None,
+            persistent_opt=False,
             **kwargs
     ):
+        """
+        :param persistent_opt: Keep the compiled optimizer in a cache keyed by the policy, the env spec and the
+        optimizer settings, so that new algo instances (or new train() calls) targeting the same policy reuse it
+        instead of rebuilding and recompiling the whole graph.
+        """
         if optimizer is None:
             if optimizer_args is None:
                 optimizer_args = dict()
@@ -27,10 +55,28 @@ class NPO(BatchPolopt):
         self.optimizer = optimizer
         self.step_size = step_size
         self.truncate_local_is_ratio = truncate_local_is_ratio
+        self.persistent_opt = persistent_opt
         super(NPO, self).__init__(**kwargs)
 
+    def _opt_signature(self):
+        if isinstance(self.optimizer, Serializable):
+            optimizer_signature = cloudpickle.dumps(Serializable.__getstate__(self.optimizer))
+        else:
+            optimizer_signature = id(self.optimizer)
+        return (type(self), _space_signature(self.env.observation_space), _space_signature(self.env.action_space),
+                self.step_size,
+                self.truncate_local_is_ratio, type(self.optimizer), optimizer_signature)
+
     @overrides
     def init_opt(self):
+        if self.persistent_opt:
+            signature = self._opt_signature()
+            cached_optimizer = _compiled_optimizers(self.policy).get(signature)
+            if cached_optimizer is not None:
+                logger.log("Reusing the compiled optimizer")
+                self.optimizer = cached_optimizer
+                return dict()
+
         is_recurrent = int(self.policy.recurrent)
         obs_var = self.env.observation_space.new_tensor_variable(
             'obs',
@@ -96,6 +142,8 @@ class NPO(BatchPolopt):
             inputs=input_list,
             constraint_name="mean_kl"
         )
+        if self.persistent_opt:
+            _compiled_optimizers(self.policy)[signature] = self.optimizer
         return dict()
 
     @overrides
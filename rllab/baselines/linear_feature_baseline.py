@@ -1,12 +1,21 @@
 from rllab.baselines.base import Baseline
+from rllab.core.parameterized import get_frozen_param_values
 from rllab.misc.overrides import overrides
 import numpy as np
+import scipy.linalg
 
 
 class LinearFeatureBaseline(Baseline):
-    def __init__(self, env_spec, reg_coeff=1e-5):
+    def __init__(self, env_spec, reg_coeff=1e-5, stat_decay=0.):
+        """
+        :param stat_decay: weight of the sufficient statistics of the previous fits. With 0 every fit only uses the
+        given paths; otherwise the statistics are exponentially decayed across iterations.
+        """
         self._coeffs = None
         self._reg_coeff = reg_coeff
+        self._stat_decay = stat_decay
+        self._xtx = None
+        self._xty = None
 
     @overrides
     def get_param_values(self, **tags):
@@ -16,28 +25,62 @@ class LinearFeatureBaseline(Baseline):
     def set_param_values(self, val, **tags):
         self._coeffs = val
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        coeffs = get_frozen_param_values(self)
+        if coeffs is not None:
+            d['_coeffs'] = coeffs
+        return d
+
     def _features(self, path):
         o = np.clip(path["observations"], -10, 10)
         l = len(path["rewards"])
         al = np.arange(l).reshape(-1, 1) / 100.0
         return np.concatenate([o, o ** 2, al, al ** 2, al ** 3, np.ones((l, 1))], axis=1)
 
+    def _features_n(self, paths):
+        # features of all the paths stacked, the time step of each row is computed from the path boundaries
+        o = np.clip(np.concatenate([path["observations"] for path in paths]), -10, 10)
+        lengths = np.array([len(path["rewards"]) for path in paths], dtype=int)
+        starts = np.cumsum(lengths) - lengths
+        al = (np.arange(np.sum(lengths)) - np.repeat(starts, lengths)).reshape(-1, 1) / 100.0
+        return np.concatenate([o, o ** 2, al, al ** 2, al ** 3, np.ones((len(al), 1))], axis=1)
+
     @overrides
     def fit(self, paths):
-        featmat = np.concatenate([self._features(path) for path in paths])
-        returns = np.concatenate([path["returns"] for path in paths])
+        # accumulate the sufficient statistics path by path instead of stacking the feature matrix of the batch
+        xtx = 0.
+        xty = 0.
+        for path in paths:
+            features = self._features(path)
+            xtx = xtx + features.T.dot(features)
+            xty = xty + features.T.dot(path["returns"])
+        if self._xtx is not None and self._stat_decay > 0:
+            xtx = xtx + self._stat_decay * self._xtx
+            xty = xty + self._stat_decay * self._xty
+        self._xtx, self._xty = xtx, xty
+
         reg_coeff = self._reg_coeff
         for _ in range(5):
-            self._coeffs = np.linalg.lstsq(
-                featmat.T.dot(featmat) + reg_coeff * np.identity(featmat.shape[1]),
-                featmat.T.dot(returns)
-            )[0]
-            if not np.any(np.isnan(self._coeffs)):
-                break
+            try:
+                self._coeffs = scipy.linalg.cho_solve(
+                    scipy.linalg.cho_factor(xtx + reg_coeff * np.identity(xtx.shape[0])), xty
+                )
+                if not np.any(np.isnan(self._coeffs)):
+                    return
+            except np.linalg.LinAlgError:
+                pass
             reg_coeff *= 10
+        self._coeffs = np.linalg.lstsq(xtx + reg_coeff * np.identity(xtx.shape[0]), xty)[0]
 
     @overrides
     def predict(self, path):
         if self._coeffs is None:
             return np.zeros(len(path["rewards"]))
         return self._features(path).dot(self._coeffs)
+
+    def predict_n(self, paths):
+        lengths = [len(path["rewards"]) for path in paths]
+        if self._coeffs is None:
+            return [np.zeros(l) for l in lengths]
+        return np.split(self._features_n(paths).dot(self._coeffs), np.cumsum(lengths)[:-1])
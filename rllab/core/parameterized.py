@@ -1,4 +1,5 @@
 from contextlib import contextmanager
+import threading
 
 from rllab.core.serializable import Serializable
 from rllab.misc.tensor_utils import flatten_tensors, unflatten_tensors
@@ -12,6 +13,29 @@ def suppress_params_loading():
     yield
     load_params = True
 
+
+_frozen = threading.local()
+
+
+@contextmanager
+def frozen_param_values(param_values):
+    """
+    Objects pickled by this thread inside the block save param_values[id(obj)] instead of their current parameters,
+    when they have an entry in it.
+    """
+    _frozen.param_values = param_values
+    try:
+        yield
+    finally:
+        _frozen.param_values = None
+
+
+def get_frozen_param_values(obj):
+    param_values = getattr(_frozen, 'param_values', None)
+    if param_values is None:
+        return None
+    return param_values.get(id(obj))
+
 class Parameterized(object):
 
     def __init__(self):
@@ -74,7 +98,8 @@ class Parameterized(object):
 
     def __getstate__(self):
         d = Serializable.__getstate__(self)
-        d["params"] = self.get_param_values()
+        params = get_frozen_param_values(self)
+        d["params"] = self.get_param_values() if params is None else params
         return d
 
     def __setstate__(self, d):
@@ -178,7 +178,7 @@ class GatherEnv(ProxyEnv, Serializable):
         self.sensor_span = sensor_span
         self.coef_inner_rew = coef_inner_rew
         self.dying_cost = dying_cost
-        self.objects = []
+        self.objects = np.zeros((0, 3))  # one (x, y, type) row per object
         self.viewer = None
         # super(GatherEnv, self).__init__(*args, **kwargs)
         model_cls = self.__class__.MODEL_CLASS
@@ -223,9 +223,9 @@ class GatherEnv(ProxyEnv, Serializable):
         ProxyEnv.__init__(self, inner_env)  # to access the inner env, do self.wrapped_env
 
     def reset(self, also_wrapped=True):
-        self.objects = []
+        objects = []
         existing = set()
-        while len(self.objects) < self.n_apples:
+        while len(objects) < self.n_apples:
             x = np.random.randint(-self.activity_range / 2,
                                   self.activity_range / 2) * 2
             y = np.random.randint(-self.activity_range / 2,
@@ -236,9 +236,9 @@ class GatherEnv(ProxyEnv, Serializable):
             if (x, y) in existing:
                 continue
             typ = APPLE
-            self.objects.append((x, y, typ))
+            objects.append((x, y, typ))
             existing.add((x, y))
-        while len(self.objects) < self.n_apples + self.n_bombs:
+        while len(objects) < self.n_apples + self.n_bombs:
             x = np.random.randint(-self.activity_range / 2,
                                   self.activity_range / 2) * 2
             y = np.random.randint(-self.activity_range / 2,
@@ -249,8 +249,9 @@ class GatherEnv(ProxyEnv, Serializable):
             if (x, y) in existing:
                 continue
             typ = BOMB
-            self.objects.append((x, y, typ))
+            objects.append((x, y, typ))
             existing.add((x, y))
+        self.objects = np.array(objects, dtype=float).reshape((-1, 3))
 
         if also_wrapped:
             self.wrapped_env.reset()
@@ -265,64 +266,38 @@ class GatherEnv(ProxyEnv, Serializable):
         com = self.wrapped_env.get_body_com("torso")
         x, y = com[:2]
         reward = self.coef_inner_rew * inner_rew
-        new_objs = []
-        for obj in self.objects:
-            ox, oy, typ = obj
-            # object within zone!
-            if (ox - x) ** 2 + (oy - y) ** 2 < self.catch_range ** 2:
-                if typ == APPLE:
-                    reward = reward + 1
-                    info['outer_rew'] = 1
-                else:
-                    reward = reward - 1
-                    info['outer_rew'] = -1
-            else:
-                new_objs.append(obj)
-        self.objects = new_objs
+        # objects within zone!
+        caught = np.sum(np.square(self.objects[:, :2] - [x, y]), axis=1) < self.catch_range ** 2
+        if np.any(caught):
+            caught_types = self.objects[caught, 2]
+            n_caught_apples = np.sum(caught_types == APPLE)
+            reward = reward + n_caught_apples - (len(caught_types) - n_caught_apples)
+            info['outer_rew'] = 1 if caught_types[-1] == APPLE else -1
+            self.objects = self.objects[~caught]
         done = len(self.objects) == 0
         return Step(self.get_current_obs(), reward, done, **info)
 
     def get_readings(self):  # equivalent to get_current_maze_obs in maze_env.py
         # compute sensor readings
-        # first, obtain current orientation
-        apple_readings = np.zeros(self.n_bins)
-        bomb_readings = np.zeros(self.n_bins)
-        robot_x, robot_y = self.wrapped_env.get_body_com("torso")[:2]
-        # sort objects by distance to the robot, so that farther objects'
-        # signals will be occluded by the closer ones'
-        sorted_objects = sorted(
-            self.objects, key=lambda o:
-            (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2)[::-1]
-        # fill the readings
-        bin_res = self.sensor_span / self.n_bins
-
+        readings = np.zeros((2, self.n_bins))  # apple readings, bomb readings
+        robot_xy = self.wrapped_env.get_body_com("torso")[:2]
         ori = self.get_ori()  # overwrite this for Ant!
-
-        for ox, oy, typ in sorted_objects:
-            # compute distance between object and robot
-            dist = ((oy - robot_y) ** 2 + (ox - robot_x) ** 2) ** 0.5
-            # only include readings for objects within range
-            if dist > self.sensor_range:
-                continue
-            angle = math.atan2(oy - robot_y, ox - robot_x) - ori
-            if math.isnan(angle):
-                import ipdb; ipdb.set_trace()
-            angle = angle % (2 * math.pi)
-            if angle > math.pi:
-                angle = angle - 2 * math.pi
-            if angle < -math.pi:
-                angle = angle + 2 * math.pi
-            # outside of sensor span - skip this
-            half_span = self.sensor_span * 0.5
-            if abs(angle) > half_span:
-                continue
-            bin_number = int((angle + half_span) / bin_res)
-            intensity = 1.0 - dist / self.sensor_range
-            if typ == APPLE:
-                apple_readings[bin_number] = intensity
-            else:
-                bomb_readings[bin_number] = intensity
-        return apple_readings, bomb_readings
+        bin_res = self.sensor_span / self.n_bins
+        half_span = self.sensor_span * 0.5
+
+        deltas = self.objects[:, :2] - robot_xy
+        dists = np.sqrt(np.sum(np.square(deltas), axis=1))
+        # angle relative to the robot orientation, wrapped to [-pi, pi]
+        angles = (np.arctan2(deltas[:, 1], deltas[:, 0]) - ori) % (2 * math.pi)
+        angles = np.where(angles > math.pi, angles - 2 * math.pi, angles)
+        # only include readings for objects within range and inside the sensor span
+        visible = (dists <= self.sensor_range) & (np.abs(angles) <= half_span)
+        bin_numbers = np.minimum(((angles[visible] + half_span) / bin_res).astype(int), self.n_bins - 1)
+        intensities = 1.0 - dists[visible] / self.sensor_range
+        is_bomb = (self.objects[visible, 2] != APPLE).astype(int)
+        # closer objects occlude the farther ones in the same bin: keep the highest intensity
+        np.maximum.at(readings, (is_bomb, bin_numbers), intensities)
+        return readings[0], readings[1]
 
     def get_current_robot_obs(self):
         return self.wrapped_env.get_current_obs()
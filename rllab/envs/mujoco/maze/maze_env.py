@@ -8,7 +8,7 @@ from rllab import spaces
 from rllab.envs.base import Step
 from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.mujoco.maze.maze_env_utils import construct_maze
-from rllab.envs.mujoco.maze.maze_env_utils import ray_segment_intersect, point_distance
+from rllab.envs.mujoco.maze.maze_env_utils import ray_segments_intersect
 from rllab.envs.mujoco.mujoco_env import MODEL_DIR, BIG
 from rllab.core.serializable import Serializable
 from rllab.misc.overrides import overrides
@@ -119,24 +119,19 @@ class MazeEnv(ProxyEnv, Serializable):
         tree.write(file_path)  # here we write a temporal file with the robot specifications. Why not the original one??
 
         self._goal_range = self._find_goal_range()
-        self._cached_segments = None
+        self._segments, self._segment_is_goal = self._find_segments()
 
         inner_env = model_cls(*args, file_path=file_path, **kwargs)  # file to the robot specifications
         ProxyEnv.__init__(self, inner_env)  # here is where the robot env will be initialized
 
-    def get_current_maze_obs(self):
-        # The observation would include both information about the robot itself as well as the sensors around its
-        # environment
-        robot_x, robot_y = self.wrapped_env.get_body_com("torso")[:2]
-        ori = self.get_ori()
-
+    def _find_segments(self):
+        """
+        Line segments of the obstacles and the goal, as an array of shape (k, 2, 2), and a mask of the goal ones
+        """
         structure = self.MAZE_STRUCTURE
         size_scaling = self.MAZE_SIZE_SCALING
-
         segments = []
-        # compute the distance of all segments
-
-        # Get all line segments of the goal and the obstacles
+        is_goal = []
         for i in range(len(structure)):
             for j in range(len(structure[0])):
                 if structure[i][j] == 1 or structure[i][j] == 'g':
@@ -146,52 +141,49 @@ class MazeEnv(ProxyEnv, Serializable):
                     x2 = cx + 0.5 * size_scaling
                     y1 = cy - 0.5 * size_scaling
                     y2 = cy + 0.5 * size_scaling
-                    struct_segments = [
+                    segments.extend([
                         ((x1, y1), (x2, y1)),
                         ((x2, y1), (x2, y2)),
                         ((x2, y2), (x1, y2)),
                         ((x1, y2), (x1, y1)),
-                    ]
-                    for seg in struct_segments:
-                        segments.append(dict(
-                            segment=seg,
-                            type=structure[i][j],
-                        ))
-
-        wall_readings = np.zeros(self._n_bins)
-        goal_readings = np.zeros(self._n_bins)
-
-        for ray_idx in range(self._n_bins):
-            ray_ori = ori - self._sensor_span * 0.5 + 1.0 * (2 * ray_idx + 1) / (2 * self._n_bins) * self._sensor_span
-            ray_segments = []
-            for seg in segments:
-                p = ray_segment_intersect(ray=((robot_x, robot_y), ray_ori), segment=seg["segment"])
-                if p is not None:
-                    ray_segments.append(dict(
-                        segment=seg["segment"],
-                        type=seg["type"],
-                        ray_ori=ray_ori,
-                        distance=point_distance(p, (robot_x, robot_y)),
-                    ))
-            if len(ray_segments) > 0:
-                first_seg = sorted(ray_segments, key=lambda x: x["distance"])[0]
-                # print first_seg
-                if first_seg["type"] == 1:
-                    # Wall -> add to wall readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        wall_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                elif first_seg["type"] == 'g':
-                    # Goal -> add to goal readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        goal_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                else:
-                    assert False
-
-        obs = np.concatenate([
-            wall_readings,
-            goal_readings
-        ])
-        return obs
+                    ])
+                    is_goal.extend([structure[i][j] == 'g'] * 4)
+        return np.array(segments, dtype=float).reshape((-1, 2, 2)), np.array(is_goal, dtype=bool)
+
+    def get_maze_obs_batch(self, robot_xys, oris):
+        """
+        Sensor readings for many robot poses at once.
+        :param robot_xys: array of shape (n, 2) with the robot positions
+        :param oris: array of shape (n,) with the robot orientations
+        :return: array of shape (n, 2 * n_bins) with the wall readings followed by the goal readings of each pose
+        """
+        robot_xys = np.asarray(robot_xys, dtype=float).reshape((-1, 2))
+        oris = np.asarray(oris, dtype=float).reshape(-1)
+        n_poses = len(robot_xys)
+        readings = np.zeros((n_poses, 2, self._n_bins))
+        if len(self._segments) == 0:
+            return readings.reshape((n_poses, -1))
+
+        bin_offsets = (2 * np.arange(self._n_bins) + 1.) / (2 * self._n_bins) * self._sensor_span
+        ray_oris = oris[:, None] - self._sensor_span * 0.5 + bin_offsets[None, :]
+        distances = ray_segments_intersect(robot_xys, ray_oris, self._segments)
+
+        # only the closest segment hit by each ray is sensed
+        first_seg = np.argmin(distances, axis=2)
+        first_distance = np.min(distances, axis=2)
+        sensed = first_distance <= self._sensor_range
+        first_is_goal = self._segment_is_goal[first_seg]
+        values = np.where(sensed, (self._sensor_range - first_distance) / self._sensor_range, 0.)
+        readings[:, 0] = np.where(first_is_goal, 0., values)
+        readings[:, 1] = np.where(first_is_goal, values, 0.)
+        return readings.reshape((n_poses, -1))
+
+    def get_current_maze_obs(self):
+        # The observation would include both information about the robot itself as well as the sensors around its
+        # environment
+        robot_xy = self.wrapped_env.get_body_com("torso")[:2]
+        ori = self.get_ori()
+        return self.get_maze_obs_batch(robot_xy, ori)[0]
 
     def get_current_robot_obs(self):
         return self.wrapped_env.get_current_obs()
@@ -90,6 +90,39 @@ def ray_segment_intersect(ray, segment):
     return None
 
 
+def ray_segments_intersect(origins, angles, segments):
+    """
+    Vectorized version of ray_segment_intersect: intersect every ray with every segment at once.
+    :param origins: array of shape (n, 2) with the origin of the rays
+    :param angles: array of shape (n, m) with the orientation of the m rays cast from each origin
+    :param segments: array of shape (k, 2, 2) with the end points (x1, y1) -- (x2, y2) of each segment
+    :return: array of shape (n, m, k) with the distance from the origin to the intersection of each ray with each
+    segment, np.inf where they do not intersect
+    """
+    DET_TOLERANCE = 0.00000001
+
+    origins = np.asarray(origins, dtype=float)
+    angles = np.asarray(angles, dtype=float)
+    segments = np.asarray(segments, dtype=float)
+    # unit direction of the rays, so that the scalar multiple r along the ray is directly the distance
+    dx1 = np.cos(angles)[:, :, None]
+    dy1 = np.sin(angles)[:, :, None]
+    dx = segments[:, 1, 0] - segments[:, 0, 0]
+    dy = segments[:, 1, 1] - segments[:, 0, 1]
+    # segment start relative to the ray origin, shape (n, 1, k)
+    x = (segments[None, :, 0, 0] - origins[:, 0, None])[:, None, :]
+    y = (segments[None, :, 0, 1] - origins[:, 1, None])[:, None, :]
+
+    det = -dx1 * dy + dy1 * dx
+    valid = np.abs(det) >= DET_TOLERANCE
+    det_inv = 1.0 / np.where(valid, det, 1.)
+
+    r = det_inv * (-dy * x + dx * y)
+    s = det_inv * (-dy1 * x + dx1 * y)
+    hit = valid & (r >= 0) & (s >= 0) & (s <= 1)
+    return np.where(hit, r, np.inf)
+
+
 def point_distance(p1, p2):
     x1, y1 = p1
     x2, y2 = p2
@@ -15,6 +15,10 @@ import joblib
 import json
 import pickle
 import base64
+import atexit
+import gzip
+import queue
+import threading
 
 _prefixes = []
 _prefix_str = ''
@@ -35,6 +39,10 @@ _tabular_header_written = set()
 _snapshot_dir = None
 _snapshot_mode = 'all'
 _snapshot_gap = 1
+_snapshot_async = False
+_snapshot_queue_depth = 2
+_snapshot_compress_level = None
+_snapshot_writer = None
 
 _log_tabular_only = False
 _header_printed = False
@@ -162,6 +170,124 @@ def set_snapshot_gap(gap):
     _snapshot_gap = gap
 
 
+def get_snapshot_async():
+    return _snapshot_async
+
+
+def set_snapshot_async(snapshot_async, queue_depth=2, compress_level=None):
+    """
+    :param snapshot_async: pickle and write the snapshots from a background thread. The calling thread only copies the
+    parameter values of the snapshotted objects and the arrays of the paths, so that the snapshot is the state of the
+    iteration even though the next one starts while it is being pickled.
+    :param queue_depth: number of pending snapshots after which save_itr_params blocks until one is written
+    :param compress_level: gzip level of the iteration snapshots (None to write them uncompressed). Compressed
+    snapshots keep their name and are read back with joblib.load or gzip.
+    """
+    global _snapshot_async, _snapshot_queue_depth, _snapshot_compress_level
+    if not snapshot_async or queue_depth != _snapshot_queue_depth:
+        flush_snapshots()
+    _snapshot_async = snapshot_async
+    _snapshot_queue_depth = queue_depth
+    _snapshot_compress_level = compress_level
+
+
+class _SnapshotWriter(object):
+    def __init__(self, queue_depth):
+        self.queue_depth = queue_depth
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        import cloudpickle
+        from rllab.core.parameterized import frozen_param_values
+        while True:
+            file_name, obj, param_values, compress_level = self._queue.get()
+            try:
+                with frozen_param_values(param_values):
+                    data = cloudpickle.dumps(obj, protocol=3)
+                _write_atomic(file_name, data, compress_level)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def put(self, file_name, obj, param_values, compress_level):
+        self._check_error()
+        self._queue.put((file_name, obj, param_values, compress_level))
+
+    def flush(self):
+        self._queue.join()
+        self._check_error()
+
+
+def _write_atomic(file_name, data, compress_level=None):
+    tmp_file_name = file_name + '.tmp'
+    if compress_level is None:
+        with open(tmp_file_name, 'wb') as f:
+            f.write(data)
+    else:
+        with gzip.open(tmp_file_name, 'wb', compresslevel=compress_level) as f:
+            f.write(data)
+    os.replace(tmp_file_name, file_name)
+
+
+def _copy_numeric_state(obj, param_values):
+    """
+    Copy of obj in which the arrays of the (nested) dicts, lists and tuples are copied, recording in param_values the
+    current parameter values of obj and of the objects it holds (e.g. the policy and baseline of an algo) by id.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if type(obj) is dict:
+        return {k: _copy_numeric_state(v, param_values) for k, v in obj.items()}
+    if type(obj) in (list, tuple):
+        return type(obj)(_copy_numeric_state(v, param_values) for v in obj)
+    if hasattr(obj, 'get_param_values'):
+        if id(obj) not in param_values:
+            param_values[id(obj)] = np.copy(obj.get_param_values())
+    elif hasattr(obj, '__dict__'):
+        for value in list(vars(obj).values()):
+            if hasattr(value, 'get_param_values') and id(value) not in param_values:
+                param_values[id(value)] = np.copy(value.get_param_values())
+    return obj
+
+
+def flush_snapshots():
+    """
+    Block until all the snapshots queued by the asynchronous writer are on disk.
+    """
+    if _snapshot_writer is not None:
+        _snapshot_writer.flush()
+
+
+atexit.register(flush_snapshots)
+
+
+def dump_pickle(file_name, obj, compress_level=None):
+    """
+    Cloudpickle obj to file_name, written to a temporary file renamed into place once complete. If the snapshots are
+    asynchronous, only the numeric state of obj is copied here and the pickling happens in the background writer.
+    """
+    global _snapshot_writer
+    if not _snapshot_async:
+        import cloudpickle
+        _write_atomic(file_name, cloudpickle.dumps(obj, protocol=3), compress_level)
+        return
+    param_values = dict()
+    obj = _copy_numeric_state(obj, param_values)
+    if _snapshot_writer is None or _snapshot_writer.queue_depth != _snapshot_queue_depth:
+        _snapshot_writer = _SnapshotWriter(_snapshot_queue_depth)
+    _snapshot_writer.put(file_name, obj, param_values, compress_level)
+
+
 def set_log_tabular_only(log_tabular_only):
     global _log_tabular_only
     _log_tabular_only = log_tabular_only
@@ -333,9 +459,7 @@ def save_itr_params(itr, params, use_cloudpickle=True, pkl_prefix=''):
         else:
             raise NotImplementedError
         if use_cloudpickle:
-            import cloudpickle
-            with open(file_name, 'wb') as f:
-                cloudpickle.dump(params, f, protocol=3)
+            dump_pickle(file_name, params, compress_level=_snapshot_compress_level)
         else:
             joblib.dump(params, file_name, compress=3)
 
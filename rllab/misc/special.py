@@ -111,6 +111,22 @@ def discount_cumsum(x, discount):
     return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
 
 
+def discount_cumsum_segments(x, discount, lengths):
+    """
+    discount_cumsum applied independently to the consecutive segments of x of the given lengths (e.g. the concatenated
+    paths of a batch), with a single filtering pass over the whole buffer.
+    """
+    lengths = np.asarray(lengths, dtype=int)
+    y = discount_cumsum(x, discount)
+    ends = np.cumsum(lengths)
+    segments = np.repeat(np.arange(len(lengths)), lengths)
+    # the filter leaks discount^(end - t) * y[end] from the following segments into each segment: remove it
+    y_after_end = np.append(y, np.zeros_like(y[:1]), axis=0)[ends]
+    steps_to_end = ends[segments] - np.arange(len(y))
+    leak = (float(discount) ** steps_to_end).reshape((-1,) + (1,) * (y.ndim - 1)) * y_after_end[segments]
+    return y - leak
+
+
 def discount_return(x, discount):
     return np.sum(x * (discount ** np.arange(len(x))))
 
@@ -46,36 +46,41 @@ class BaseSampler(Sampler):
         self.algo = algo
 
     def process_samples(self, itr, paths):
-        baselines = []
-        returns = []
-
         if hasattr(self.algo.baseline, "predict_n"):
             all_path_baselines = self.algo.baseline.predict_n(paths)
         else:
             all_path_baselines = [self.algo.baseline.predict(path) for path in paths]
 
-        for idx, path in enumerate(paths):
-            path_baselines = np.append(all_path_baselines[idx], 0)
-            deltas = path["rewards"] + \
-                     self.algo.discount * path_baselines[1:] - \
-                     path_baselines[:-1]
-            path["advantages"] = special.discount_cumsum(
-                deltas, self.algo.discount * self.algo.gae_lambda)
-            path["returns"] = special.discount_cumsum(path["rewards"], self.algo.discount)
-            baselines.append(path_baselines[:-1])
-            returns.append(path["returns"])
-
-        ev = special.explained_variance_1d(
-            np.concatenate(baselines),
-            np.concatenate(returns)
-        )
+        # advantages and returns of all the paths in one pass over the concatenated buffers, the per-path arrays are
+        # views of the flat ones
+        path_lengths = np.array([len(path["rewards"]) for path in paths], dtype=int)
+        path_ends = np.cumsum(path_lengths)
+        path_starts = path_ends - path_lengths
+        rewards = tensor_utils.concat_tensor_list([path["rewards"] for path in paths])
+        baselines = np.concatenate(all_path_baselines)
+        next_baselines = np.append(baselines[1:], 0)
+        next_baselines[path_ends - 1] = 0
+        deltas = rewards + self.algo.discount * next_baselines - baselines
+        advantages = special.discount_cumsum_segments(deltas, self.algo.discount * self.algo.gae_lambda, path_lengths)
+        returns = special.discount_cumsum_segments(rewards, self.algo.discount, path_lengths)
+        for path, path_advantages, path_returns in zip(paths, np.split(advantages, path_ends[:-1]),
+                                                       np.split(returns, path_ends[:-1])):
+            path["advantages"] = path_advantages
+            path["returns"] = path_returns
+
+        ev = special.explained_variance_1d(baselines, returns)
+
+        # empty paths return 0: indexing returns at their start or reduceat would give the next path's value
+        non_empty = path_lengths > 0
+        discounted_returns = np.zeros(len(paths))
+        discounted_returns[non_empty] = returns[path_starts[non_empty]]
+        average_discounted_return = np.mean(discounted_returns)
+        cumulative_rewards = np.append(0, np.cumsum(rewards))
+        undiscounted_returns = cumulative_rewards[path_ends] - cumulative_rewards[path_starts]
 
         if not self.algo.policy.recurrent:
             observations = tensor_utils.concat_tensor_list([path["observations"] for path in paths])
             actions = tensor_utils.concat_tensor_list([path["actions"] for path in paths])
-            rewards = tensor_utils.concat_tensor_list([path["rewards"] for path in paths])
-            returns = tensor_utils.concat_tensor_list([path["returns"] for path in paths])
-            advantages = tensor_utils.concat_tensor_list([path["advantages"] for path in paths])
             env_infos = tensor_utils.concat_tensor_dict_list([path["env_infos"] for path in paths])
             agent_infos = tensor_utils.concat_tensor_dict_list([path["agent_infos"] for path in paths])
 
@@ -85,11 +90,6 @@ class BaseSampler(Sampler):
             if self.algo.positive_adv:
                 advantages = util.shift_advantages_to_positive(advantages)
 
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
-
-            undiscounted_returns = [sum(path["rewards"]) for path in paths]
-
             ent = np.mean(self.algo.policy.distribution.entropy(agent_infos))
 
             samples_data = dict(
@@ -141,11 +141,6 @@ class BaseSampler(Sampler):
             valids = [np.ones_like(path["returns"]) for path in paths]
             valids = tensor_utils.pad_tensor_n(valids, max_path_length)
 
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
-
-            undiscounted_returns = [sum(path["rewards"]) for path in paths]
-
             ent = np.sum(self.algo.policy.distribution.entropy(agent_infos) * valids) / np.sum(valids)
 
             samples_data = dict(
@@ -1,4 +1,4 @@
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, batch_rollout, get_env_copies, mark_env_updated
 from rllab.sampler.stateful_pool import singleton_pool, SharedGlobal
 from rllab.misc import ext
 from rllab.misc import logger
@@ -6,8 +6,18 @@ from rllab.misc import tensor_utils
 # import pickle
 import cloudpickle as pickle
 import numpy as np
+import os
+import os.path as osp
+import shutil
+import tempfile
+from collections import namedtuple
 import tensorflow as tf
 
+# tmpfs directory under which the workers write the collected path arrays, when available
+_SHARED_MEMORY_ROOT = '/dev/shm' if osp.isdir('/dev/shm') else None
+# array written to a file of a shared memory directory, to be mapped back by the master
+SharedArray = namedtuple('SharedArray', ['file_name', 'offset', 'dtype', 'shape'])
+
 
 def _worker_init(G, id):
     if singleton_pool.n_parallel > 1:
@@ -74,6 +84,32 @@ def populate_task(env, policy, scope=None):
     logger.log("Populated")
 
 
+def is_populated(env, policy, scope=None):
+    """ Whether the given env and policy are the ones currently populated in the workers for this scope """
+    return scope in _cached_populate_env and _cached_populate_env[scope] is env and \
+           _cached_populate_policy[scope] is policy
+
+
+def _worker_update_env_generator(G, generator, update_method, scope=None):
+    G = _get_scoped_G(G, scope)
+    getattr(G.env, update_method)(pickle.loads(generator))
+
+
+def update_env_generator(generator, update_method='update_start_generator', scope=None):
+    """
+    Swap a state generator of the env populated in the workers (through its update_start_generator or
+    update_goal_generator method) by only broadcasting the pickled generator, instead of re-populating the whole env
+    and policy with populate_task.
+    """
+    if singleton_pool.n_parallel > 1:
+        singleton_pool.run_each(
+            _worker_update_env_generator,
+            [(pickle.dumps(generator), update_method, scope)] * singleton_pool.n_parallel
+        )
+    else:
+        getattr(_get_scoped_G(singleton_pool.G, scope).env, update_method)(generator)
+
+
 def terminate_task(scope=None):
     singleton_pool.run_each(
         _worker_terminate_task,
@@ -103,12 +139,66 @@ def _worker_set_policy_params(G, params, scope=None):
 def _worker_set_env_params(G, params, scope=None):
     G = _get_scoped_G(G, scope)
     G.env.set_param_values(params)
+    mark_env_updated(G.env)
+
 
+def _write_shared_tensors(value, f, file_name):
+    if isinstance(value, dict):
+        return {k: _write_shared_tensors(v, f, file_name) for k, v in value.items()}
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        offset = f.tell()
+        padding = -offset % 64  # keep every array aligned
+        f.write(b'\0' * padding)
+        np.ascontiguousarray(value).tofile(f)
+        return SharedArray(file_name, offset + padding, value.dtype.str, value.shape)
+    return value
 
-def _worker_collect_one_path(G, max_path_length, scope=None):
+
+def write_shared_path(path, shm_dir):
+    """
+    Append the arrays of the path to the file of this process in shm_dir and return the path with every array
+    replaced by a SharedArray (its offset in the file). Object arrays and other values are left as they are.
+    """
+    file_name = osp.join(shm_dir, '%d.bin' % os.getpid())
+    with open(file_name, 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        return _write_shared_tensors(path, f, file_name)
+
+
+def _read_shared_tensors(value, buffers):
+    if isinstance(value, dict):
+        return {k: _read_shared_tensors(v, buffers) for k, v in value.items()}
+    if isinstance(value, SharedArray):
+        if value.file_name not in buffers:
+            # copy-on-write mapping: the views stay valid once the file is removed and can be modified in place
+            buffers[value.file_name] = np.memmap(value.file_name, dtype=np.uint8, mode='c')
+        return np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=buffers[value.file_name],
+                          offset=value.offset)
+    return value
+
+
+def read_shared_paths(paths):
+    """ Rebuild the paths written by write_shared_path as zero-copy views of the mapped files """
+    buffers = dict()
+    return [_read_shared_tensors(path, buffers) for path in paths]
+
+
+def _worker_collect_one_path(G, max_path_length, scope=None, shm_dir=None):
     G = _get_scoped_G(G, scope)
     path = rollout(G.env, G.policy, max_path_length)
-    return path, len(path["rewards"])
+    n_samples = len(path["rewards"])
+    if shm_dir is not None:
+        path = write_shared_path(path, shm_dir)
+    return path, n_samples
+
+
+def _worker_collect_batch_paths(G, max_path_length, n_envs, scope=None, shm_dir=None):
+    G = _get_scoped_G(G, scope)
+    paths = batch_rollout(get_env_copies(G.env, n_envs), G.policy, max_path_length)
+    n_samples = sum(len(path["rewards"]) for path in paths)
+    if shm_dir is not None:
+        paths = [write_shared_path(path, shm_dir) for path in paths]
+    return paths, n_samples
 
 
 # def _worker_collect_one_path_snn(G, max_path_length, switch_lat_every=0, scope=None):
@@ -121,13 +211,19 @@ def sample_paths(
         max_samples,
         max_path_length=np.inf,
         env_params=None,
-        scope=None):
+        scope=None,
+        n_envs=1,
+        shared_memory=False):
     """
     :param policy_params: parameters for the policy. This will be updated on each worker process
     :param max_samples: desired maximum number of samples to be collected. The actual number of collected samples
     might be greater since all trajectories will be rolled out either until termination or until max_path_length is
     reached
     :param max_path_length: horizon / maximum length of a single trajectory
+    :param n_envs: number of env copies stepped in lockstep by each worker, querying the policy once per timestep
+    for all of them (see batch_rollout)
+    :param shared_memory: have the workers write the path arrays to files in shared memory and only return their
+    offsets, instead of pickling the paths back through the pool. The paths are then views of the mapped files.
     :return: a list of collected paths
     """
     singleton_pool.run_each(
@@ -139,12 +235,31 @@ def sample_paths(
             _worker_set_env_params,
             [(env_params, scope)] * singleton_pool.n_parallel
         )
-    return singleton_pool.run_collect(
-        _worker_collect_one_path,
-        threshold=max_samples,
-        args=(max_path_length, scope),
-        show_prog_bar=True
-    )
+    shm_dir = None
+    if shared_memory and singleton_pool.n_parallel > 1:
+        shm_dir = tempfile.mkdtemp(prefix='rllab_paths_', dir=_SHARED_MEMORY_ROOT)
+    try:
+        if n_envs > 1:
+            path_batches = singleton_pool.run_collect(
+                _worker_collect_batch_paths,
+                threshold=max_samples,
+                args=(max_path_length, n_envs, scope, shm_dir),
+                show_prog_bar=True
+            )
+            paths = [path for paths in path_batches for path in paths]
+        else:
+            paths = singleton_pool.run_collect(
+                _worker_collect_one_path,
+                threshold=max_samples,
+                args=(max_path_length, scope, shm_dir),
+                show_prog_bar=True
+            )
+        if shm_dir is not None:
+            paths = read_shared_paths(paths)
+    finally:
+        if shm_dir is not None:
+            shutil.rmtree(shm_dir)
+    return paths
 
 
 def truncate_paths(paths, max_samples):
@@ -1,4 +1,3 @@
-from joblib.pool import MemmapingPool
 import multiprocessing as mp
 from rllab.misc import logger
 import pyprind
@@ -41,6 +40,8 @@ class StatefulPool(object):
         self.pool = None
         self.queue = None
         self.worker_queue = None
+        self.collect_counter = None
+        self.collect_done = None
         self.G = SharedGlobal()
 
     def initialize(self, n_parallel):
@@ -54,11 +55,9 @@ class StatefulPool(object):
         if n_parallel > 1:
             self.queue = mp.Queue()
             self.worker_queue = mp.Queue()
-            # FIXME: memmap is slow.
-            # self.pool = MemmapingPool(
-            #     self.n_parallel,
-            #     temp_folder="/tmp",
-            # )
+            # shared with the workers through inheritance; used by run_collect
+            self.collect_counter = mp.Value('i', 0)
+            self.collect_done = mp.Event()
             self.pool = mp.Pool(
                 self.n_parallel
             )
@@ -122,26 +121,23 @@ class StatefulPool(object):
         if args is None:
             args = tuple()
         if self.pool:
-            manager = mp.Manager()
-            counter = manager.Value('i', 0)
-            lock = manager.RLock()
+            self.collect_counter.value = 0
+            self.collect_done.clear()
             results = self.pool.map_async(
                 _worker_run_collect,
-                [(collect_once, counter, lock, threshold, args)] * self.n_parallel
+                [(collect_once, threshold, args)] * self.n_parallel
             )
             if show_prog_bar:
                 pbar = ProgBarCounter(threshold)
             last_value = 0
-            while True:
-                time.sleep(0.1)
-                with lock:
-                    if counter.value >= threshold:
-                        if show_prog_bar:
-                            pbar.stop()
-                        break
-                    if show_prog_bar:
-                        pbar.inc(counter.value - last_value)
-                    last_value = counter.value
+            # the worker reaching the threshold sets collect_done, which wakes the master right away
+            while not self.collect_done.wait(0.1) and not results.ready():
+                if show_prog_bar:
+                    value = self.collect_counter.value
+                    pbar.inc(value - last_value)
+                    last_value = value
+            if show_prog_bar:
+                pbar.stop()
             print('Done sampling.')
             start = time.time()
             out = sum(results.get(), [])
@@ -181,18 +177,19 @@ def _worker_run_each(all_args):
 
 def _worker_run_collect(all_args):
     try:
-        collect_once, counter, lock, threshold, args = all_args
+        collect_once, threshold, args = all_args
+        counter = singleton_pool.collect_counter
         collected = []
-        while True:
-            with lock:
-                if counter.value >= threshold:
-                    return collected
+        # only start a new collection while the threshold is not reached, so that the overshoot is bounded by the
+        # collections already in flight in the other workers
+        while counter.value < threshold:
             result, inc = collect_once(singleton_pool.G, *args)
             collected.append(result)
-            with lock:
+            with counter.get_lock():
                 counter.value += inc
                 if counter.value >= threshold:
-                    return collected
+                    singleton_pool.collect_done.set()
+        return collected
     except Exception:
         raise Exception("".join(traceback.format_exception(*sys.exc_info())))
 
@@ -1,15 +1,98 @@
 import numpy as np
 from rllab.misc import tensor_utils
+import cloudpickle
 import time
+import weakref
+
+
+class _ArrayColumn(object):
+    """
+    Column of a path written in place into a preallocated array. As soon as a row does not fit in it (different shape,
+    or a dtype that can not be cast safely) the column falls back to a list of rows stacked at the end.
+    """
+
+    def __init__(self, example, capacity):
+        example = np.asarray(example)
+        self._buffer = None
+        self._rows = None
+        if example.dtype == object:
+            self._rows = []
+        else:
+            self._buffer = np.empty((capacity,) + example.shape, dtype=example.dtype)
+
+    def write(self, idx, value):
+        if self._buffer is not None:
+            array = np.asarray(value)
+            if array.shape == self._buffer.shape[1:] and \
+                    (array.dtype == self._buffer.dtype or np.can_cast(array.dtype, self._buffer.dtype)):
+                if idx >= len(self._buffer):
+                    self._buffer = np.concatenate([self._buffer, np.empty_like(self._buffer)])
+                self._buffer[idx] = array
+                return
+            self._rows = list(self._buffer[:idx])
+            self._buffer = None
+        self._rows.append(value)
+
+    def stacked(self, length):
+        if self._buffer is not None:
+            # a view would keep the whole preallocated buffer alive for paths that terminated early
+            if length < len(self._buffer):
+                return self._buffer[:length].copy()
+            return self._buffer
+        return tensor_utils.stack_tensor_list(self._rows)
+
+
+class _DictColumn(object):
+    def __init__(self, example, capacity):
+        self._columns = dict(
+            (k, _DictColumn(v, capacity) if isinstance(v, dict) else _ArrayColumn(v, capacity))
+            for k, v in example.items()
+        )
+
+    def write(self, idx, value):
+        for k, column in self._columns.items():
+            column.write(idx, value[k])
+
+    def stacked(self, length):
+        return dict((k, column.stacked(length)) for k, column in self._columns.items())
+
+
+class PathBuilder(object):
+    """
+    Collect the steps of a rollout into typed arrays preallocated up to max_path_length once the first step reveals
+    the schema of the infos, instead of stacking lists of per-step dicts at the end. The built path holds the buffers,
+    copied to their actual length if the path ended early, and has the same format as the one produced with
+    tensor_utils.stack_tensor_dict_list.
+    """
+
+    def __init__(self, max_path_length=np.inf):
+        self._capacity = max(int(max_path_length), 1) if np.isfinite(max_path_length) else 128
+        self._columns = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, observation, action, reward, agent_info, env_info, done):
+        step = dict(observations=observation, actions=action, rewards=reward, agent_infos=agent_info,
+                    env_infos=env_info, dones=done)
+        if self._columns is None:
+            self._columns = _DictColumn(step, self._capacity)
+        self._columns.write(self._length, step)
+        self._length += 1
+
+    def build(self, last_obs):
+        if self._columns is None:
+            path = dict(observations=np.array([]), actions=np.array([]), rewards=np.array([]), agent_infos=dict(),
+                        env_infos=dict(), dones=np.array([], dtype=bool))
+        else:
+            path = self._columns.stacked(self._length)
+        path["last_obs"] = last_obs
+        return path
 
 
 def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_state=None, no_action = False):
-    observations = []
-    actions = []
-    rewards = []
-    agent_infos = []
-    env_infos = []
-    dones = []
+    path_builder = PathBuilder(max_path_length)
     # no_action = True
     if init_state is not None:
         o = env.reset(init_state)
@@ -24,12 +107,7 @@ def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_
         if no_action:
             a = np.zeros_like(a)
         next_o, r, d, env_info = env.step(a)
-        observations.append(env.observation_space.flatten(o))
-        rewards.append(r)
-        actions.append(env.action_space.flatten(a))
-        agent_infos.append(agent_info)
-        env_infos.append(env_info)
-        dones.append(d)
+        path_builder.append(env.observation_space.flatten(o), env.action_space.flatten(a), r, agent_info, env_info, d)
         path_length += 1
         if d:
             break
@@ -41,12 +119,79 @@ def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_
     if animated:
         env.render(close=False)
 
-    return dict(
-        observations=tensor_utils.stack_tensor_list(observations),
-        actions=tensor_utils.stack_tensor_list(actions),
-        rewards=tensor_utils.stack_tensor_list(rewards),
-        agent_infos=tensor_utils.stack_tensor_dict_list(agent_infos),
-        env_infos=tensor_utils.stack_tensor_dict_list(env_infos),
-        dones=np.asarray(dones),
-        last_obs=o,
-    )
+    return path_builder.build(last_obs=o)
+
+
+_env_copies = weakref.WeakKeyDictionary()
+
+
+def mark_env_updated(env):
+    """
+    Record that the state of env (state generators, parameters, ...) changed, so that the copies cached by
+    get_env_copies for it, or for any env wrapping it, are rebuilt on their next use.
+    """
+    env.__dict__['_env_version'] = env.__dict__.get('_env_version', 0) + 1
+
+
+def _env_versions(env):
+    # versions of env and of all the envs it wraps, as the update may have gone to an inner env
+    versions = []
+    seen = set()
+    while env is not None and id(env) not in seen:
+        seen.add(id(env))
+        versions.append(getattr(env, '__dict__', dict()).get('_env_version', 0))
+        env = getattr(env, 'wrapped_env', None)
+    return tuple(versions)
+
+
+def get_env_copies(env, n_envs):
+    """
+    Return n_envs independent copies of env (the first one being env itself), to be stepped in lockstep by
+    batch_rollout. The copies are cached as long as env is alive, so repeated calls only pay the pickling once, and
+    rebuilt once env has been updated (see mark_env_updated).
+    """
+    versions = _env_versions(env)
+    cached_versions, copies = _env_copies.get(env, (versions, []))
+    if cached_versions != versions:
+        copies = []
+    if len(copies) < n_envs - 1:
+        copies = copies + [cloudpickle.loads(cloudpickle.dumps(env)) for _ in range(n_envs - 1 - len(copies))]
+    _env_copies[env] = (versions, copies)
+    return [env] + copies[:n_envs - 1]
+
+
+def batch_rollout(envs, agent, max_path_length=np.inf, init_states=None):
+    """
+    Roll out one trajectory in each of the given envs, stepping them in lockstep. The agent is queried once per
+    timestep through get_actions for all the envs that are not done yet, so it must be a non-recurrent policy.
+    :param envs: list of independent env copies (see get_env_copies)
+    :param agent: policy implementing get_actions
+    :param max_path_length: horizon of every rollout
+    :param init_states: optional list of initial states, one per env
+    :return: a list of paths, one per env, in the same format as rollout
+    """
+    n_envs = len(envs)
+    if init_states is not None:
+        obses = [env.reset(init_state) for env, init_state in zip(envs, init_states)]
+    else:
+        obses = [env.reset() for env in envs]
+    agent.reset()
+    path_builders = [PathBuilder(max_path_length) for _ in range(n_envs)]
+    running = list(range(n_envs))
+    path_length = 0
+    while len(running) > 0 and path_length < max_path_length:
+        batch_actions, batch_agent_infos = agent.get_actions([obses[idx] for idx in running])
+        split_agent_infos = tensor_utils.split_tensor_dict_list(batch_agent_infos) or [dict()] * len(running)
+        still_running = []
+        for a, agent_info, idx in zip(batch_actions, split_agent_infos, running):
+            env = envs[idx]
+            next_o, r, d, env_info = env.step(a)
+            path_builders[idx].append(env.observation_space.flatten(obses[idx]), env.action_space.flatten(a), r,
+                                      agent_info, env_info, d)
+            if not d:
+                obses[idx] = next_o
+                still_running.append(idx)
+        running = still_running
+        path_length += 1
+
+    return [path_builder.build(last_obs=obs) for path_builder, obs in zip(path_builders, obses)]
@@ -6,6 +6,8 @@ import base64
 import pickle
 import json
 import itertools
+import io
+from collections import defaultdict
 # import ipywidgets
 # import IPython.display
 # import plotly.offline as po
@@ -38,6 +40,74 @@ def load_progress(progress_csv_path):
     return entries
 
 
+CACHE_FILE_NAME = '.viskit_cache.pkl'
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime, stat.st_ino
+
+
+def _parse_progress_rows(text, fieldnames, columns):
+    for row in csv.DictReader(io.StringIO(text), fieldnames=fieldnames):
+        for k, v in row.items():
+            if k not in columns:
+                columns[k] = []
+            try:
+                columns[k].append(float(v))
+            except:
+                columns[k].append(0.)
+
+
+def load_progress_cached(progress_csv_path, cached=None):
+    """
+    Same as load_progress, but only parses the rows appended since the cached record of a previous call.
+    :param cached: record returned by a previous call for the same file, or None
+    :return: the progress entries, and the record to pass to the next call
+    """
+    stat = _file_stat(progress_csv_path)
+    if cached is not None and cached['stat'] == stat:
+        return dict(zip(cached['keys'], cached['values'])), cached
+    with open(progress_csv_path, 'rb') as f:
+        header = f.readline()
+        if cached is not None and cached['header'] == header and cached.get('inode') == stat[2] and \
+                stat[0] >= cached['offset']:
+            # the file may also have been rewritten from scratch with the same header (relaunched experiment), in
+            # which case the bytes before the cached offset are not the ones that were parsed
+            f.seek(cached['offset'] - len(cached['tail']))
+            if f.read(len(cached['tail'])) != cached['tail']:
+                cached = None
+        else:
+            cached = None
+        if cached is None:
+            print("Reading %s" % progress_csv_path)
+            f.seek(len(header))
+            cached = dict(header=header, offset=len(header), tail=header, keys=[], values=[], stat=None)
+        else:
+            print("Reading new rows of %s" % progress_csv_path)
+        data = f.read()
+    fieldnames = next(csv.reader([header.decode('utf-8')])) if len(header) > 0 else []
+    # only the complete lines are cached, a partially written last line is parsed again next time
+    complete = data[:data.rfind(b'\n') + 1]
+    entries = dict(zip(cached['keys'], cached['values']))
+    new_rows = dict()
+    _parse_progress_rows(complete.decode('utf-8'), fieldnames, new_rows)
+    for k, v in new_rows.items():
+        entries[k] = np.concatenate([entries[k], v]) if k in entries else np.array(v)
+    # the last parsed line (the header if there is none) identifies the parsed prefix of the file
+    last_line = complete[complete.rfind(b'\n', 0, len(complete) - 1) + 1:] if len(complete) > 0 else cached['tail']
+    cached = dict(header=header, offset=cached['offset'] + len(complete), tail=last_line, inode=stat[2],
+                  keys=list(entries.keys()), values=list(entries.values()),
+                  stat=stat if len(complete) == len(data) else None)
+    if len(complete) < len(data):
+        partial_row = dict()
+        _parse_progress_rows(data[len(complete):].decode('utf-8'), fieldnames, partial_row)
+        entries = dict(entries)
+        for k, v in partial_row.items():
+            entries[k] = np.concatenate([entries[k], v]) if k in entries else np.array(v)
+    return entries, cached
+
+
 def to_json(stub_object):
     from rllab.misc.instrument import StubObject
     from rllab.misc.instrument import StubAttr
@@ -93,7 +163,42 @@ def lookup(d, keys):
     return d
 
 
-def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False):
+def _load_cache(exp_path):
+    try:
+        with open(os.path.join(exp_path, CACHE_FILE_NAME), 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return dict()
+
+
+def _save_cache(exp_path, cache):
+    # the experiment folders may be read-only, in which case they are just parsed every time
+    cache_path = os.path.join(exp_path, CACHE_FILE_NAME)
+    try:
+        with open(cache_path + '.tmp', 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + '.tmp', cache_path)
+    except (IOError, OSError):
+        pass
+
+
+def _load_params_cached(params_json_path, cache):
+    stat = _file_stat(params_json_path)
+    cached = cache.get('params')
+    if cached is not None and cached['path'] == params_json_path and cached['stat'] == stat:
+        return cached['params'], cached['flat_params']
+    params = load_params(params_json_path)
+    flat_params = flatten_dict(params)
+    cache['params'] = dict(path=params_json_path, stat=stat, params=params, flat_params=flat_params)
+    return params, flat_params
+
+
+def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False, use_cache=True):
+    """
+    :param use_cache: keep the parsed progress and params of every experiment in a cache file in its folder,
+    invalidated by the size and modification time of the files. Only the rows appended to progress.csv since the
+    last load are parsed.
+    """
     exps = []
     for exp_folder_path in exp_folder_paths:
         exps += [x[0] for x in os.walk(exp_folder_path, followlinks=True)]
@@ -105,16 +210,28 @@ def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=
             params_json_path = os.path.join(exp_path, "params.json")
             variant_json_path = os.path.join(exp_path, "variant.json")
             progress_csv_path = os.path.join(exp_path, "progress.csv")
-            progress = load_progress(progress_csv_path)
-            if disable_variant:
-                params = load_params(params_json_path)
-            else:
-                try:
-                    params = load_params(variant_json_path)
-                except IOError:
+            if not use_cache:
+                progress = load_progress(progress_csv_path)
+                if disable_variant:
                     params = load_params(params_json_path)
+                else:
+                    try:
+                        params = load_params(variant_json_path)
+                    except IOError:
+                        params = load_params(params_json_path)
+                flat_params = flatten_dict(params)
+            else:
+                cache = _load_cache(exp_path)
+                cached_progress, cached_params = cache.get('progress'), cache.get('params')
+                progress, cache['progress'] = load_progress_cached(progress_csv_path, cached_progress)
+                if disable_variant or not os.path.exists(variant_json_path):
+                    params, flat_params = _load_params_cached(params_json_path, cache)
+                else:
+                    params, flat_params = _load_params_cached(variant_json_path, cache)
+                if cache['progress'] is not cached_progress or cache['params'] is not cached_params:
+                    _save_cache(exp_path, cache)
             exps_data.append(ext.AttrDict(
-                progress=progress, params=params, flat_params=flatten_dict(params)))
+                progress=progress, params=params, flat_params=dict(flat_params)))
         except IOError as e:
             print(e)
 
@@ -211,8 +328,39 @@ def extract_distinct_params(exps_data, excluded_params=('exp_name', 'log_dir'),
     return filtered
 
 
+class ParamIndex(object):
+    """
+    Inverted index of the flat params of a list of experiments, built lazily for the keys the selectors filter on.
+    Build it once per loaded list and give it to every Selector on that list, so that the postings of a key are only
+    computed once.
+    """
+
+    def __init__(self, exps_data):
+        self._exps_data = exps_data
+        self._by_key = dict()
+
+    def matching(self, k, v):
+        """
+        :return: the set of indices of the experiments whose param k is v (as strings) or that do not have k
+        """
+        if k not in self._by_key:
+            by_value = defaultdict(set)
+            missing = set()
+            for idx, exp in enumerate(self._exps_data):
+                if k in exp.flat_params:
+                    by_value[str(exp.flat_params[k])].add(idx)
+                else:
+                    missing.add(idx)
+            self._by_key[k] = (by_value, missing)
+        by_value, missing = self._by_key[k]
+        return by_value.get(str(v), set()) | missing
+
+
 class Selector(object):
-    def __init__(self, exps_data, filters=None, custom_filters=None):
+    def __init__(self, exps_data, filters=None, custom_filters=None, index=None, _candidates=None):
+        """
+        :param index: ParamIndex of exps_data, shared with the other selectors on the same list (built if None)
+        """
         self._exps_data = exps_data
         if filters is None:
             self._filters = tuple()
@@ -222,24 +370,35 @@ class Selector(object):
             self._custom_filters = []
         else:
             self._custom_filters = custom_filters
+        # the index is shared by all the selectors derived from this one, the candidates are the indices of the
+        # experiments satisfying the filters
+        self._index = ParamIndex(exps_data) if index is None else index
+        if _candidates is None:
+            for k, v in self._filters:
+                matching = self._index.matching(k, v)
+                _candidates = matching if _candidates is None else _candidates & matching
+        self._candidates = _candidates
 
     def where(self, k, v):
-        return Selector(self._exps_data, self._filters + ((k, v),), self._custom_filters)
+        candidates = self._index.matching(k, v)
+        if self._candidates is not None:
+            candidates = candidates & self._candidates
+        return Selector(self._exps_data, self._filters + ((k, v),), self._custom_filters, self._index, candidates)
 
     def custom_filter(self, filter):
-        return Selector(self._exps_data, self._filters, self._custom_filters + [filter])
+        return Selector(self._exps_data, self._filters, self._custom_filters + [filter], self._index,
+                        self._candidates)
 
-    def _check_exp(self, exp):
-        # or exp.flat_params.get(k, None) is None
-        return all(
-            ((str(exp.flat_params.get(k, None)) == str(v) or (k not in exp.flat_params)) for k, v in self._filters)
-        ) and all(custom_filter(exp) for custom_filter in self._custom_filters)
+    def _check_custom(self, exp):
+        return all(custom_filter(exp) for custom_filter in self._custom_filters)
 
     def extract(self):
-        return list(filter(self._check_exp, self._exps_data))
+        return list(self.iextract())
 
     def iextract(self):
-        return filter(self._check_exp, self._exps_data)
+        if self._candidates is None:
+            return filter(self._check_custom, self._exps_data)
+        return filter(self._check_custom, (self._exps_data[idx] for idx in sorted(self._candidates)))
 
 
 # Taken from plot.ly
@@ -40,6 +40,7 @@ app = flask.Flask(__name__, static_url_path='/static')
 exps_data = None
 plottable_keys = None
 distinct_params = None
+exps_index = None
 
 
 @app.route('/js/<path:path>')
@@ -270,11 +271,9 @@ def get_plot_instruction(
         show_highest_sofar=False,
 ):
     print(plot_key, split_key, group_key, filters)
+    selector = core.Selector(exps_data, index=exps_index)
     if filter_nan:
-        nonnan_exps_data = list(filter(check_nan, exps_data))
-        selector = core.Selector(nonnan_exps_data)
-    else:
-        selector = core.Selector(exps_data)
+        selector = selector.custom_filter(check_nan)
     if legend_post_processor is None:
         legend_post_processor = lambda x: x
     if filters is None:
@@ -338,7 +337,7 @@ def get_plot_instruction(
                     best_regret = -np.inf
                     kv_string_best_regret = None
                     for idx, params in enumerate(product_space):
-                        selector = core.Selector(exps_data)
+                        selector = core.Selector(exps_data, index=exps_index)
                         for k, v in zip(filtered_params_k, params):
                             selector = selector.where(k, str(v))
                         data = selector.extract()
@@ -725,10 +724,12 @@ def reload_data():
     global exps_data
     global plottable_keys
     global distinct_params
-    exps_data = core.load_exps_data(args.data_paths, args.disable_variant)
+    global exps_index
+    exps_data = core.load_exps_data(args.data_paths, args.disable_variant, use_cache=not args.disable_cache)
     plottable_keys = sorted(list(
         set(flatten(list(exp.progress.keys()) for exp in exps_data))))
     distinct_params = sorted(core.extract_distinct_params(exps_data))
+    exps_index = core.ParamIndex(exps_data)
 
 
 if __name__ == "__main__":
@@ -738,6 +739,8 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true", default=False)
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--disable-variant", default=False, action='store_true')
+    parser.add_argument("--disable-cache", default=False, action='store_true',
+        help='Parse all the progress and params files instead of using the per-experiment cache')
     parser.add_argument("-o", default=False, action='store_true',
         help='Open a brower tab automatically')
     args = parser.parse_args(sys.argv[1:])
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from curriculum.state import evaluator
+from curriculum.state.evaluator import parallel_map, label_states_from_paths, _group_rows, label_states, \
+    mean_confidence_interval, evaluate_states_adaptive
+
+
+class _OffsetEnv(object):
+
+    def __init__(self, offset):
+        self.offset = offset
+
+
+def _add_offset(x, env=None):
+    return x + (0 if env is None else env.offset)
+
+
+def test_parallel_map():
+    xs = list(range(10))
+    for num_processes in [1, -1, 2]:
+        assert parallel_map(_add_offset, xs, num_processes=num_processes) == xs
+
+
+def test_parallel_map_resident_env():
+    xs = list(range(10))
+    env = _OffsetEnv(3)
+    for num_processes in [1, -1, 2]:
+        assert parallel_map(_add_offset, xs, num_processes=num_processes, env=env) == [x + 3 for x in xs]
+    # the env is changed in place between two calls: the new state must be used
+    env.offset = 5
+    assert parallel_map(_add_offset, xs, env=env) == [x + 5 for x in xs]
+
+
+class _StartSpaceEnv(object):
+
+    def transform_to_start_space(self, obs, env_infos=None):
+        return obs[:2]
+
+
+def _random_paths(states, n_paths):
+    paths = []
+    for _ in range(n_paths):
+        state = states[np.random.randint(len(states))]
+        path_length = np.random.randint(1, 6)
+        observations = np.random.randn(path_length, 3)
+        observations[0, :2] = state
+        paths.append(dict(
+            observations=observations,
+            rewards=np.random.rand(path_length),
+            env_infos=dict(goal=np.tile(state, (path_length, 1))),
+        ))
+    return paths
+
+
+def _group_path_rewards(all_paths, as_goal, env):
+    # grouping previously done by label_states_from_paths, in order of first occurrence
+    state_dict = OrderedDict()
+    for paths in all_paths:
+        for path in paths:
+            if as_goal:
+                state = tuple(path['env_infos']['goal'][0])
+            else:
+                state = tuple(env.transform_to_start_space(path['observations'][0]))
+            state_dict.setdefault(state, []).append(np.sum(path['rewards']))
+    return state_dict
+
+
+def test_group_rows():
+    rows = np.array([[0., 1.], [2., 3.], [-0., 1.], [2., 3.], [4., 5.], [0., 1.]])
+    first_index, groups, counts = _group_rows(rows)
+    np.testing.assert_array_equal(first_index, [0, 1, 4])
+    np.testing.assert_array_equal(groups, [0, 1, 0, 1, 2, 0])
+    np.testing.assert_array_equal(counts, [3, 2, 1])
+
+
+def test_label_states_from_paths():
+    # duplicated states, with -0. and 0. being the same state
+    states = [np.array([0., 1.]), np.array([-0., 1.]), np.array([0.5, -0.]), np.array([0.5, 0.]),
+              np.array([2., 3.]), np.array([-1., 4.])]
+    env = _StartSpaceEnv()
+    for as_goal in [True, False]:
+        all_paths = [_random_paths(states, 15), _random_paths(states, 10)]
+        state_dict = _group_path_rewards(all_paths, as_goal, env)
+        for n_traj in [1, 3]:
+            labeled_states, _, mean_rewards = label_states_from_paths(
+                all_paths, as_goal=as_goal, env=env, n_traj=n_traj, return_mean_rewards=True)
+            expected = [(state, np.mean(rewards)) for state, rewards in state_dict.items() if len(rewards) >= n_traj]
+            np.testing.assert_array_equal(labeled_states, np.array([state for state, _ in expected]))
+            np.testing.assert_allclose(mean_rewards, np.array([[mean_reward] for _, mean_reward in expected]))
+
+        # states returned in a given order, with a state that was never visited
+        order_of_states = [states[4], states[1], np.array([7., 7.])]
+        ordered_states, _, mean_rewards, updated = label_states_from_paths(
+            all_paths, as_goal=as_goal, env=env, return_mean_rewards=True, order_of_states=order_of_states)
+        assert updated == [tuple(state) in state_dict for state in order_of_states]
+        expected_mean_rewards = [np.mean(state_dict.get(tuple(state), [0])) for state in order_of_states]
+        np.testing.assert_allclose(mean_rewards, np.array(expected_mean_rewards).reshape(-1, 1))
+
+
+def test_mean_confidence_interval():
+    # Wilson score interval of 5 and 10 successes out of 10, two-sided 95%
+    low, high = mean_confidence_interval([5., 10.], [10, 10], confidence_z=1.96)
+    np.testing.assert_allclose(low, [0.23659, 0.72246], atol=1e-5)
+    np.testing.assert_allclose(high, [0.76341, 1.], atol=1e-5)
+    # rescaled to the reward range
+    low, high = mean_confidence_interval([0.], [10], confidence_z=1.96, reward_range=(-1., 1.))
+    np.testing.assert_allclose([low[0], high[0]], [2 * 0.23659 - 1, 2 * 0.76341 - 1], atol=1e-5)
+    # Hoeffding interval: half width sqrt(log(2 / 0.05) / (2 n))
+    low, high = mean_confidence_interval([50.], [100], confidence_z=1.96, binary=False)
+    np.testing.assert_allclose([low[0], high[0]], [0.5 - 0.13581, 0.5 + 0.13581], atol=1e-4)
+    # no rollouts: the whole range
+    low, high = mean_confidence_interval([0.], [0], reward_range=(-2., 3.), binary=False)
+    assert (low[0], high[0]) == (-2., 3.)
+
+
+class _FakeEvaluation(object):
+    """ Replaces evaluate_states: the state i gets the rewards reward_table[i] in turn """
+
+    def __init__(self, reward_table):
+        self.reward_table = reward_table
+        self.n_rollouts = np.zeros(len(reward_table), dtype=int)
+
+    def __call__(self, states, env, policy, horizon, n_traj=1, **kwargs):
+        result = []
+        for i in states:
+            result.append(np.array(self.reward_table[i][self.n_rollouts[i]:self.n_rollouts[i] + n_traj]))
+            self.n_rollouts[i] += n_traj
+        return np.array(result)
+
+
+def _run_adaptive(reward_table, **kwargs):
+    evaluate_states = evaluator.evaluate_states
+    evaluator.evaluate_states = _FakeEvaluation(reward_table)
+    try:
+        return evaluate_states_adaptive(list(range(len(reward_table))), None, None, 10, **kwargs)
+    finally:
+        evaluator.evaluate_states = evaluate_states
+
+
+def _adaptive_n_rollouts(reward_table, n_traj, round_traj, min_reward, max_reward, confidence_z, reward_range,
+                         binary):
+    # each state evaluated on its own, in rounds of round_traj until its label is settled
+    n_rollouts = []
+    for rewards in reward_table:
+        n = 0
+        while n < n_traj:
+            n = min(n + round_traj, n_traj)
+            low, high = mean_confidence_interval([np.sum(rewards[:n])], [n], confidence_z, reward_range, binary)
+            if high[0] <= min_reward or low[0] >= max_reward or (low[0] > min_reward and high[0] < max_reward):
+                break
+        n_rollouts.append(n)
+    return n_rollouts
+
+
+def test_evaluate_states_adaptive_binary():
+    n_traj = 40
+    reward_table = [np.zeros(n_traj), np.ones(n_traj), (np.random.rand(n_traj) < 0.5).astype(float),
+                    (np.random.rand(n_traj) < 0.9).astype(float)]
+    for round_traj in [1, 3, 10]:
+        mean_rewards, n_rollouts = _run_adaptive(reward_table, n_traj=n_traj, round_traj=round_traj)
+        expected = _adaptive_n_rollouts(reward_table, n_traj, round_traj, 0.1, 0.9, 1.64, (0., 1.), True)
+        np.testing.assert_array_equal(n_rollouts, expected)
+        np.testing.assert_allclose(mean_rewards, [np.mean(rewards[:n]) for rewards, n in zip(reward_table, expected)])
+        # the states always failing or succeeding are settled before n_traj
+        assert n_rollouts[0] < n_traj and n_rollouts[1] < n_traj
+
+
+def test_evaluate_states_adaptive_bounded():
+    n_traj = 30
+    reward_range = (-2., 2.)
+    reward_table = [np.random.uniform(-2., -1.5, n_traj), np.random.uniform(-2., 2., n_traj),
+                    np.random.uniform(1.5, 2., n_traj)]
+    for round_traj in [1, 5]:
+        mean_rewards, n_rollouts = _run_adaptive(reward_table, n_traj=n_traj, round_traj=round_traj,
+                                                 min_reward=-1., max_reward=1., reward_range=reward_range)
+        expected = _adaptive_n_rollouts(reward_table, n_traj, round_traj, -1., 1., 1.64, reward_range, False)
+        np.testing.assert_array_equal(n_rollouts, expected)
+        np.testing.assert_allclose(mean_rewards, [np.mean(rewards[:n]) for rewards, n in zip(reward_table, expected)])
+
+
+def test_evaluate_states_adaptive_no_rollouts():
+    mean_rewards, n_rollouts = _run_adaptive([[], []], n_traj=0)
+    np.testing.assert_array_equal(n_rollouts, [0, 0])
+    assert np.all(np.isnan(mean_rewards))
+
+
+def test_evaluate_states_adaptive_out_of_range():
+    try:
+        _run_adaptive([[0.5, 2.]], n_traj=2, round_traj=2)
+    except ValueError:
+        pass
+    else:
+        assert False, "rewards outside of reward_range should raise"
+
+
+def test_label_states_adaptive_reward_range():
+    try:
+        label_states([0], None, None, 10, adaptive=True)
+    except ValueError:
+        pass
+    else:
+        assert False, "adaptive labelling of the env rewards should require a reward_range"
+    evaluate_states = evaluator.evaluate_states
+    evaluator.evaluate_states = _FakeEvaluation([[1.] * 5, [0.] * 5])
+    try:
+        labels, n_rollouts = label_states([0, 1], None, None, 10, key='goal_reached', n_traj=5, adaptive=True,
+                                          return_n_traj=True)
+    finally:
+        evaluator.evaluate_states = evaluate_states
+    np.testing.assert_array_equal(labels, [[1., 0.], [0., 1.]])
+    assert np.all(n_rollouts <= 5)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from rllab.baselines.linear_feature_baseline import LinearFeatureBaseline
+
+
+def _random_paths(n_paths, obs_dim):
+    paths = []
+    for _ in range(n_paths):
+        path_length = np.random.randint(1, 30)
+        paths.append(dict(
+            observations=np.random.randn(path_length, obs_dim),
+            rewards=np.random.randn(path_length),
+            returns=np.random.randn(path_length),
+        ))
+    return paths
+
+
+def _lstsq_coeffs(baseline, paths, reg_coeff):
+    # fit previously done on the stacked feature matrix of the batch
+    featmat = np.concatenate([baseline._features(path) for path in paths])
+    returns = np.concatenate([path["returns"] for path in paths])
+    return np.linalg.lstsq(
+        featmat.T.dot(featmat) + reg_coeff * np.identity(featmat.shape[1]),
+        featmat.T.dot(returns)
+    )[0]
+
+
+def test_fit():
+    baseline = LinearFeatureBaseline(env_spec=None)
+    for _ in range(3):
+        paths = _random_paths(10, 4)
+        baseline.fit(paths)
+        np.testing.assert_allclose(baseline.get_param_values(), _lstsq_coeffs(baseline, paths, 1e-5),
+                                   rtol=1e-5, atol=1e-8)
+
+
+def test_predict_n():
+    baseline = LinearFeatureBaseline(env_spec=None)
+    paths = _random_paths(5, 3)
+    baseline.fit(paths)
+    for predicted, path in zip(baseline.predict_n(paths), paths):
+        np.testing.assert_allclose(predicted, baseline.predict(path))
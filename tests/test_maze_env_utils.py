@@ -0,0 +1,22 @@
+import numpy as np
+
+from rllab.envs.mujoco.maze.maze_env_utils import ray_segment_intersect, ray_segments_intersect, point_distance
+
+
+def test_ray_segments_intersect():
+    origins = np.random.uniform(-2, 2, size=(5, 2))
+    angles = np.random.uniform(-np.pi, np.pi, size=(5, 8))
+    segments = np.random.uniform(-3, 3, size=(12, 2, 2))
+    # axis aligned segments, as the maze walls
+    segments[:6, 1, 0] = segments[:6, 0, 0]
+    segments[6:, 1, 1] = segments[6:, 0, 1]
+    dists = ray_segments_intersect(origins, angles, segments)
+    assert dists.shape == (5, 8, 12)
+    for i, origin in enumerate(origins):
+        for j, angle in enumerate(angles[i]):
+            for k, segment in enumerate(segments):
+                point = ray_segment_intersect((tuple(origin), angle), [tuple(segment[0]), tuple(segment[1])])
+                if point is None:
+                    assert np.isinf(dists[i, j, k])
+                else:
+                    np.testing.assert_allclose(dists[i, j, k], point_distance(point, origin), atol=1e-8)
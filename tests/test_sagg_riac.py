@@ -0,0 +1,62 @@
+import numpy as np
+
+from curriculum.algos.sagg_riac.SaggRIAC import Region, _window_interests
+
+
+def _compute_interest(competences, max_history):
+    # interest previously computed by Region.compute_interest with python slices
+    num_states = len(competences)
+    if num_states == 0:
+        return 0
+    old_measure = np.sum(competences[num_states - max_history:num_states - int(max_history / 2)])
+    new_measure = np.sum(competences[num_states - int(max_history / 2):num_states])
+    return abs(old_measure - new_measure) / num_states
+
+
+def test_window_interests():
+    for max_history in [1, 2, 7, 10]:
+        num_states = np.array([0, 1, 3, 4, 5, 9, 10, 11, 25, 0])
+        competences = [np.random.rand(n) for n in num_states]
+        offset = np.cumsum(num_states) - num_states
+        prefix = np.tile(np.concatenate([[0.], np.cumsum(np.concatenate(competences))]), (len(num_states), 1))
+        interests = _window_interests(prefix, offset, num_states, max_history)
+        expected = [_compute_interest(c, max_history) for c in competences]
+        np.testing.assert_allclose(interests, expected, atol=1e-12)
+
+
+def test_compute_interest():
+    for num_states in [0, 1, 4, 6, 13, 40]:
+        region = Region(np.zeros(2), np.ones(2), max_history=12)
+        region.add_states(np.random.rand(num_states, 2), np.random.rand(num_states))
+        np.testing.assert_allclose(region.compute_interest(), _compute_interest(region.competences, 12), atol=1e-12)
+
+
+def test_optimal_split():
+    for num_states, max_history in [(30, 100), (30, 9), (200, 50), (3, 10)]:
+        region = Region(np.zeros(2), np.ones(2), max_history=max_history, num_random_splits=20)
+        # clustered states, so that some of the candidate splits leave one half short or empty
+        states = np.random.rand(num_states, 2) * np.array([0.3, 1.])
+        region.add_states(states, np.random.rand(num_states))
+
+        np.random.seed(num_states)
+        region1, region2, success = region.optimal_split()
+        assert success
+        np.random.seed(num_states)
+        split_dims = np.random.randint(2, size=region.num_random_splits)
+        split_vals = np.random.uniform(region.min_border[split_dims], region.max_border[split_dims])
+
+        # score of each candidate from the regions it creates, as the former optimal_split
+        scores = []
+        for split_dim, split_val in zip(split_dims, split_vals):
+            candidate1, candidate2 = region.make_regions(split_dim, split_val)
+            region.assign_states_to_regions(candidate1, candidate2)
+            interest1 = _compute_interest(candidate1.competences, max_history)
+            interest2 = _compute_interest(candidate2.competences, max_history)
+            np.testing.assert_allclose([candidate1.compute_interest(), candidate2.compute_interest()],
+                                       [interest1, interest2], atol=1e-12)
+            scores.append(candidate1.num_goals * candidate2.num_goals * abs(interest1 - interest2))
+        best = int(np.argmax(scores))
+        assert (region.split_dim, region.split_val) == (split_dims[best], split_vals[best])
+        np.testing.assert_array_equal(region1.states, region.states[region.states[:, split_dims[best]] <=
+                                                                    split_vals[best]])
+        assert region1.num_goals + region2.num_goals == num_states
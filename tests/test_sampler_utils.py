@@ -0,0 +1,121 @@
+import numpy as np
+
+from rllab.misc import tensor_utils
+from rllab.sampler.utils import get_env_copies, mark_env_updated, PathBuilder
+
+
+class _CountingEnv(object):
+
+    def __init__(self, wrapped_env=None):
+        self.wrapped_env = wrapped_env
+        self.value = 0
+
+
+def test_get_env_copies_cached():
+    env = _CountingEnv()
+    copies = get_env_copies(env, 3)
+    assert len(copies) == 3 and copies[0] is env
+    assert copies[1] is not env and copies[2] is not copies[1]
+    assert get_env_copies(env, 3) == copies
+    assert get_env_copies(env, 2) == copies[:2]
+    assert get_env_copies(env, 4)[:3] == copies
+
+
+def test_get_env_copies_invalidation():
+    env = _CountingEnv()
+    copies = get_env_copies(env, 3)
+    env.value = 1
+    mark_env_updated(env)
+    new_copies = get_env_copies(env, 3)
+    assert all(new_copy is not copy for new_copy, copy in zip(new_copies[1:], copies[1:]))
+    assert all(new_copy.value == 1 for new_copy in new_copies)
+
+
+def test_get_env_copies_wrapped_invalidation():
+    inner_env = _CountingEnv()
+    env = _CountingEnv(wrapped_env=inner_env)
+    copies = get_env_copies(env, 2)
+    inner_env.value = 1
+    mark_env_updated(inner_env)
+    new_copies = get_env_copies(env, 2)
+    assert new_copies[1] is not copies[1]
+    assert new_copies[1].wrapped_env.value == 1
+
+
+def _build_path(steps, max_path_length):
+    builder = PathBuilder(max_path_length)
+    for step in steps:
+        builder.append(*step)
+    return builder.build(last_obs=None)
+
+
+def _stack_path(steps):
+    # path previously built by rollout from the lists of steps
+    keys = ['observations', 'actions', 'rewards', 'agent_infos', 'env_infos', 'dones']
+    return tensor_utils.stack_tensor_dict_list([dict(zip(keys, step)) for step in steps])
+
+
+def _assert_same_path(path, expected):
+    assert set(path.keys()) == set(expected.keys())
+    for k, v in expected.items():
+        if isinstance(v, dict):
+            _assert_same_path(path[k], v)
+        else:
+            assert path[k].dtype == v.dtype, (k, path[k].dtype, v.dtype)
+            assert path[k].shape == v.shape
+            if v.dtype == object:  # e.g. rows of different shapes
+                for row, expected_row in zip(path[k].ravel(), v.ravel()):
+                    np.testing.assert_array_equal(row, expected_row)
+            else:
+                np.testing.assert_array_equal(path[k], v)
+
+
+def _check_path_builder(steps, max_path_length):
+    try:
+        expected = _stack_path(steps)
+    except ValueError:  # rows that numpy can not stack
+        try:
+            _build_path(steps, max_path_length)
+        except ValueError:
+            return
+        assert False, "the path builder stacked rows that stack_tensor_list can not"
+    path = _build_path(steps, max_path_length)
+    assert path.pop('last_obs') is None
+    _assert_same_path(path, expected)
+
+
+def _step(t, reward=1., env_info=None, agent_info=None):
+    return (np.array([t, 2. * t]), np.array([-t]), reward, agent_info or dict(mean=np.ones(1) * t),
+            env_info or dict(goal=np.zeros(2), nested=dict(count=t)), t == 4)
+
+
+def test_path_builder():
+    steps = [_step(t) for t in range(5)]
+    for max_path_length in [5, 20, np.inf]:
+        _check_path_builder(steps, max_path_length)
+    path = _build_path(steps, 20)
+    # the path ended early: its columns are not views of the preallocated buffers
+    assert path['observations'].base is None and len(path['observations']) == 5
+
+
+def test_path_builder_int_then_float_reward():
+    steps = [_step(0, reward=1), _step(1, reward=1), _step(2, reward=0.5)]
+    _check_path_builder(steps, 10)
+    assert _build_path(steps, 10)['rewards'].dtype == float
+
+
+def test_path_builder_shape_change():
+    steps = [_step(t, env_info=dict(goal=np.zeros(2 if t < 2 else 3))) for t in range(4)]
+    _check_path_builder(steps, 10)
+
+
+def test_path_builder_object_infos():
+    steps = [_step(t, env_info=dict(obj=None if t % 2 else slice(t), name='s' * (t + 1))) for t in range(4)]
+    _check_path_builder(steps, 10)
+
+
+def test_path_builder_growth():
+    steps = [_step(t) for t in range(300)]
+    _check_path_builder(steps, np.inf)
+    steps.append(_step(300, reward=0.5, env_info=dict(goal=np.zeros(2), nested=dict(count=0.5))))
+    _check_path_builder(steps, np.inf)
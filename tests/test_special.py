@@ -0,0 +1,21 @@
+import numpy as np
+
+from rllab.misc import special
+
+
+def test_discount_cumsum_segments():
+    lengths = [5, 1, 0, 7, 3]
+    rewards = np.random.randn(sum(lengths))
+    for discount in [0., 0.5, 0.99, 1.]:
+        segments = special.discount_cumsum_segments(rewards, discount, lengths)
+        paths = np.split(rewards, np.cumsum(lengths)[:-1])
+        expected = np.concatenate([special.discount_cumsum(path, discount) for path in paths])
+        np.testing.assert_allclose(segments, expected)
+
+
+def test_discount_cumsum_segments_multidim():
+    lengths = [4, 6]
+    x = np.random.randn(sum(lengths), 3)
+    segments = special.discount_cumsum_segments(x, 0.9, lengths)
+    expected = np.concatenate([special.discount_cumsum(x[:4], 0.9), special.discount_cumsum(x[4:], 0.9)])
+    np.testing.assert_allclose(segments, expected)
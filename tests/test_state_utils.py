@@ -0,0 +1,67 @@
+import numpy as np
+import scipy.spatial
+
+from curriculum.state.utils import StateIndex, select_distant_points, IndexedMaxHeap, SmartStateCollection
+
+
+def test_state_index_min_distances():
+    index = StateIndex()
+    indexed = []
+    for n_points in [1, 7, 3, 20, 2, 50]:
+        points = np.random.randn(n_points, 3)
+        index.add(points)
+        indexed.append(points)
+        queries = np.random.randn(10, 3)
+        expected = np.amin(scipy.spatial.distance.cdist(np.concatenate(indexed), queries), axis=0)
+        np.testing.assert_allclose(index.min_distances(queries), expected)
+        assert index.size == sum(len(points) for points in indexed)
+
+
+def test_state_index_distance_upper_bound():
+    index = StateIndex()
+    index.add(np.random.randn(30, 2))
+    queries = np.random.randn(20, 2)
+    dists = index.min_distances(queries)
+    bounded = index.min_distances(queries, distance_upper_bound=0.5)
+    np.testing.assert_allclose(bounded[dists <= 0.5], dists[dists <= 0.5])
+    assert np.all(np.isinf(bounded[dists > 0.5]))
+
+
+def test_state_index_empty():
+    assert np.all(np.isinf(StateIndex().min_distances(np.random.randn(4, 2))))
+
+
+def test_select_distant_points():
+    points = np.random.rand(200, 2)
+    distance_threshold = 0.1
+    # greedy filtering previously done by StateCollection._process_states
+    expected = [0]
+    for i in range(1, len(points)):
+        if np.amin(scipy.spatial.distance.cdist(points[expected], points[i:i + 1])) > distance_threshold:
+            expected.append(i)
+    keep = select_distant_points(points, distance_threshold)
+    np.testing.assert_array_equal(np.nonzero(keep)[0], expected)
+
+
+def test_indexed_max_heap_top():
+    heap = IndexedMaxHeap()
+    priorities = dict()
+    for item in range(100):
+        priorities[item] = np.random.rand()
+        heap.push(item, priorities[item])
+    for item in np.random.choice(100, 40, replace=False):
+        priorities[item] = np.random.rand()
+        heap.update(item, priorities[item])
+    # selection previously done by SmartStateCollection.sample
+    for k in [0, 1, 10, 100, 150]:
+        expected = sorted(priorities, key=lambda item: priorities[item], reverse=True)[:k]
+        assert heap.top(k) == expected
+    assert len(heap) == 100
+
+
+def test_smart_state_collection_signed_zero():
+    collection = SmartStateCollection(distance_threshold=0.01)
+    collection.update_starts(np.array([[0., 1.], [2., 3.]]), [0.5, 0.5])
+    collection.update_starts(np.array([[-0., 1.]]), [0.1])
+    assert collection.size == 2
+    assert collection.prev_vals[0] == 0.1
@@ -0,0 +1,48 @@
+import itertools
+
+from rllab.misc import ext
+from rllab.viskit import core
+
+
+def _check_exp(exp, filters, custom_filters):
+    # matching previously done by Selector._check_exp
+    return all(
+        ((str(exp.flat_params.get(k, None)) == str(v) or (k not in exp.flat_params)) for k, v in filters)
+    ) and all(custom_filter(exp) for custom_filter in custom_filters)
+
+
+def _exps_data():
+    exps_data = []
+    for seed, lr, algo in itertools.product([1, 2, 3], [0.1, 0.01, None], ["trpo", "ppo"]):
+        flat_params = dict(seed=seed, lr=lr, algo=algo)
+        if seed == 3:
+            del flat_params["algo"]
+        exps_data.append(ext.AttrDict(flat_params=flat_params, progress=dict()))
+    return exps_data
+
+
+def test_selector_where():
+    exps_data = _exps_data()
+    index = core.ParamIndex(exps_data)
+    custom_filter = lambda exp: exp.flat_params["seed"] != 2
+    filter_sets = [
+        [],
+        [("seed", 1)],
+        [("seed", "1"), ("lr", 0.1)],
+        [("lr", None), ("algo", "trpo")],
+        [("algo", "ppo"), ("lr", 0.01), ("seed", 3)],
+        [("seed", 4)],
+        [("missing", "x")],
+    ]
+    for filters in filter_sets:
+        for custom_filters in [[], [custom_filter]]:
+            selector = core.Selector(exps_data, index=index)
+            for k, v in filters:
+                selector = selector.where(k, v)
+            for custom in custom_filters:
+                selector = selector.custom_filter(custom)
+            expected = [exp for exp in exps_data if _check_exp(exp, filters, custom_filters)]
+            assert selector.extract() == expected
+            assert list(selector.iextract()) == expected
+            # a selector given its filters directly, building its own index, selects the same experiments
+            assert core.Selector(exps_data, filters, custom_filters).extract() == expected